@@ -0,0 +1,110 @@
+'''This script times the metrics code at the bottom of the bootstrap,
+jackknife, and combo search loops, reporting calls per second for each layer:
+
+  1. the 2x2 table, from sklearn's confusion_matrix() and from clf_counts()
+  2. the metrics kernel, metric_array(), on one table
+  3. clf_metrics() returning a plain array and returning a data frame
+  4. the old clf_metrics(), which built its 2x2 table with confusion_matrix()
+     and its output from two data frames, for comparison
+
+It runs on simulated labels, so it needs no data files.
+'''
+
+import numpy as np
+import pandas as pd
+import timeit
+
+from sklearn.metrics import confusion_matrix
+
+import tools
+
+
+# Numbers of records to simulate labels for
+N_RECORDS = [200, 5000]
+
+# Number of calls to time for each layer
+N_CALLS = 2000
+
+# Prevalence and predicted prevalence for the simulated labels
+TRUE_PREV = 0.3
+PRED_PREV = 0.35
+
+# Seed for the simulated labels
+SEED = 2020
+
+
+def legacy_clf_metrics(targets, guesses, round=4):
+    '''The clf_metrics() from before the metrics kernel, kept as a reference
+    for timing.'''
+    # Constructing the 2x2 table
+    confmat = confusion_matrix(targets, guesses)
+    tp = confmat[1, 1]
+    fp = confmat[0, 1]
+    tn = confmat[0, 0]
+    fn = confmat[1, 0]
+    
+    # Calculating basic measures of diagnostic accuracy
+    sens = np.round(tp / (tp + fn), round)
+    spec = np.round(tn / (tn + fp), round)
+    ppv = np.round(tp / (tp + fp), round)
+    npv = np.round(tn / (tn + fn), round)
+    f1 = np.round(2 * (sens * ppv) / (sens + ppv), round)
+    j = sens + spec - 1
+    mcc_num = ((tp * tn) - (fp * fn))
+    mcc_denom = np.sqrt(((tp+fp)*(tp+fn)*(tn+fp)*(tn+fn)))
+    mcc = mcc_num / mcc_denom
+    brier = np.round(tools.brier_score(targets, guesses), round)
+    outmat = np.array([tp, fp, tn, fn,
+                       sens, spec, ppv,
+                       npv, j, f1, mcc, brier]).reshape(-1, 1)
+    out = pd.DataFrame(outmat.transpose(),
+                       columns=['tp', 'fp', 'tn', 
+                                'fn', 'sens', 'spec', 
+                                'ppv', 'npv', 'j', 
+                                'f1', 'mcc', 'brier'])
+    
+    # Calculating some additional measures based on positive calls
+    true_prev = int(np.sum(targets == 1))
+    pred_prev = int(np.sum(guesses == 1))
+    abs_diff = (true_prev - pred_prev) * -1
+    rel_diff = np.round(abs_diff / true_prev, round)
+    count_outmat = np.array([true_prev, pred_prev, abs_diff, 
+                             rel_diff]).reshape(-1, 1)
+    count_out = pd.DataFrame(count_outmat.transpose(),
+                             columns=['true_prev', 'pred_prev', 
+                                      'prev_diff', 'rel_prev_diff'])
+    return pd.concat([out, count_out], axis=1)
+
+
+rng = np.random.default_rng(SEED)
+
+for n in N_RECORDS:
+    targets = np.array(rng.random(n) < TRUE_PREV, dtype=np.uint8)
+    guesses = np.array(rng.random(n) < PRED_PREV, dtype=np.uint8)
+    counts = tools.clf_counts(targets, guesses)
+
+    # Making sure the lean and formatted versions agree before timing them
+    lean = tools.clf_metrics(targets, guesses, mcnemar=True, as_frame=False)
+    framed = tools.clf_metrics(targets, guesses, mcnemar=True)
+    assert np.allclose(lean, framed.values[0], equal_nan=True)
+    legacy = legacy_clf_metrics(targets, guesses)
+    assert np.allclose(legacy.values[0], lean[:-1], equal_nan=True)
+
+    layers = {
+        'confusion_matrix': lambda: confusion_matrix(targets, guesses),
+        'clf_counts': lambda: tools.clf_counts(targets, guesses),
+        'metric_array': lambda: tools.metric_array(tp=counts[3],
+                                                   fp=counts[1],
+                                                   tn=counts[0],
+                                                   fn=counts[2]),
+        'clf_metrics (array)': lambda: tools.clf_metrics(targets,
+                                                         guesses,
+                                                         as_frame=False),
+        'clf_metrics (frame)': lambda: tools.clf_metrics(targets, guesses),
+        'clf_metrics (legacy)': lambda: legacy_clf_metrics(targets, guesses)
+    }
+
+    print('n = ' + str(n))
+    for name, fn in layers.items():
+        secs = timeit.timeit(fn, number=N_CALLS)
+        print('  {:<20} {:>10,.0f} calls/sec'.format(name, N_CALLS / secs))
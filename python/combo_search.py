@@ -10,8 +10,7 @@ import xlsxwriter
 import itertools
 import time
 
-from multiprocessing import Pool
-from sklearn.metrics import f1_score
+from multiprocessing import cpu_count
 
 import tools
 import multi
@@ -19,9 +18,30 @@ import multi
 # Whether to calculate statistics for any-of-n combinations
 RUN_SINGLE = False
 
+# Whether to calculate statistics for the any-of-n combinations from every 
+# subset of symptoms, with no limit on size, from the symptom pattern counts
+RUN_LATTICE = False
+
+# Minimum sensitivities for finding the best specificity in the full lattice
+LATTICE_SENS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+
 # Whether to calculate statistics for combinations of combinations (metacombos)
 RUN_META = True
 
+# Whether to skip metacombos whose F1 bounds can't make the top best_n
+PRUNE = True
+
+# Whether to score each logically distinct metacombo only once
+DEDUP = True
+
+# Whether to save each metacombo run as it finishes and skip finished runs
+# when the script is restarted
+CHECKPOINT = True
+
+# Whether to collapse the records to their distinct symptom patterns before
+# scoring the rules, so the work scales with the number of patterns
+COMPRESS = True
+
 # Whether to omit the 13 sero+/PCR- contacts from the primary analysis
 OMIT_DISC = True
 
@@ -72,7 +92,7 @@ group_names = ['all', 'adults', 'kids']
 
 # Calculating performance for the any-of-n (single) and m-of-n [and/or] 
 # m-of-n (meta) combinations
-p = Pool()
+p = multi.worker_pool()
 
 # Setting the maximum combination size
 c_min = 1
@@ -98,15 +118,39 @@ if RUN_SINGLE:
         # Pulling out the features and targets for each stratum
         ftrs = tup[0]
         tgts = tup[1]
+        n_rec = tgts.shape[0]
+        
+        # Optionally swapping the records for the stratum's pattern table,
+        # in which case the rules in cy_list are for its rows instead
+        planes = None
+        if COMPRESS:
+            ftrs, tgts, wts = tools.pattern_table(ftrs, tgts)
+            planes = tools.weight_planes(wts)
         
-        # Getting the performance stats for each combo
-        combo_input = [ftrs[:, cols] for cols in col_combos]
-        combo_y = p.map(tools.rowsums, combo_input)
-        combo_stats = pd.concat(p.starmap(tools.clf_metrics, 
-                                        [(tgts, preds) for preds in combo_y]),
-                                axis=0)
-        combo_stats['rule'] = cnames_list
-        combo_stats['combo_size'] = nums
+        # Packing the features so each any-of-n rule is a single OR over
+        # the bitsets for its columns
+        ftr_bits = tools.pack_cols(ftrs)
+        tgt_bits = tools.pack_cols(tgts)[0]
+        
+        # Building each combo size from the rules for the size before it and
+        # getting the performance stats for the whole level in one batch
+        level_stats = []
+        level_y = []
+        for k, k_combos, k_y in tools.packed_any_levels(ftr_bits, 
+                                                        c_max, 
+                                                        c_min):
+            k_stats = tools.batch_clf_metrics(tgt_bits, 
+                                              k_y, 
+                                              n=n_rec, 
+                                              planes=planes)
+            k_stats['rule'] = [[symptom_list[n] for n in combo] 
+                               for combo in k_combos]
+            k_stats['combo_size'] = k
+            level_stats.append(k_stats)
+            level_y.append(k_y)
+        
+        combo_stats = pd.concat(level_stats, axis=0, ignore_index=True)
+        combo_y = np.concatenate(level_y, axis=0)
         cstat_list.append(combo_stats)
         cy_list.append(combo_y)
     
@@ -118,62 +162,155 @@ if RUN_SINGLE:
             df.to_excel(writer, sheet_name=group_names[i])
         writer.save()
 
+# Calculating performance for the any-of-n combinations from all subsets
+if RUN_LATTICE:
+    lstat_list = []
+    lbest_list = []
+    for i, tup in enumerate(groups):
+        # Getting the metrics for all the subsets in one pass over the 
+        # pattern counts, with the rules indexed by symptom bitmask
+        lattice_stats = tools.lattice_metrics(tup[0], tup[1])
+        lattice_stats['rule'] = [[symptom_list[n] 
+                                  for n in range(len(symptom_list)) 
+                                  if (mask >> n) & 1]
+                                 for mask in lattice_stats.index]
+        lstat_list.append(lattice_stats)
+        
+        # Finding the best specificity for each minimum sensitivity across
+        # the whole lattice, along with the smallest rule that gets it
+        best = []
+        for sens in LATTICE_SENS:
+            if not np.any(lattice_stats.sens >= sens):
+                continue
+            spec = tools.x_at_y('spec', 'sens', sens, lattice_stats)
+            hits = lattice_stats[(lattice_stats.sens >= sens) &
+                                 (lattice_stats.spec == spec)]
+            hit = hits.sort_values('combo_size').iloc[0]
+            best.append([group_names[i], sens, spec, 
+                         hit.sens, hit.combo_size, hit.rule])
+        lbest_list.append(pd.DataFrame(best, 
+                                       columns=['group', 'min_sens', 
+                                                'spec', 'sens', 
+                                                'combo_size', 'rule']))
+    
+    # Writing the lattice stats to disk
+    if EXCEL:
+        writer = pd.ExcelWriter(file_dir + 'lattice_stats.xlsx')
+        for i, df in enumerate(lstat_list):
+            df.to_excel(writer, sheet_name=group_names[i])
+        pd.concat(lbest_list, axis=0).to_excel(writer, 
+                                               sheet_name='best spec',
+                                               index=False)
+        writer.save()
+
 # Calculating performance for the metacombinations
 if RUN_META:
-    meta_iter = [pair for pair in itertools.combinations(col_combos, 2)]
-    metacombos = p.map(tools.unique_combo, meta_iter)
-    metacombos = [c for c in metacombos if c is not None]
-    
     # Combos of m for m-of-n
     mcs = [pair for pair in itertools.permutations(range(1, 6), 2)]
     mcs += [(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)]
     
-    # Sums for at least 2 
-    raw_pairsums = [[(X, c, mc) for c in metacombos] for mc in mcs]
+    # Optionally scoring the rules on the pattern table instead of the
+    # records, with each row weighted by its number of records
+    X_rows, y_rows, w_rows = X, y, None
+    planes = None
+    if COMPRESS:
+        X_rows, y_rows, w_rows = tools.pattern_table(X, y)
+        planes = tools.weight_planes(w_rows)
     
-    # Weeding out combinations that don't make sense
-    pairsum_input = []
-    for i, pairs in enumerate(raw_pairsums):
-        good_pairs = [pair for pair in pairs if len(pair[1][0]) >= pair[2][0] 
-                      and len(pair[1][1]) >= pair[2][1]]
-        pairsum_input.append(good_pairs)
+    # Packing the features and targets into bitsets to keep the inputs small
+    X_bits = tools.pack_cols(X_rows)
+    y_bits = tools.pack_cols(y_rows)[0]
+    n_pos = tools.popcount(y_bits, planes)
+    n_neg = y.shape[0] - n_pos
     
-    # Empty list to hold the best indices from each run
-    top_performers = []
+    # Putting the packed features in shared memory so the tasks only have to 
+    # carry column numbers
+    arrays = {'X_bits': X_bits, 'y_bits': y_bits}
+    if COMPRESS:
+        arrays['planes'] = planes
+    shared = multi.shared_arrays(**arrays)
     
     # Max number of combos to consider from 'and', 'or', and 'any'
     best_n = 10
     
-    for run_num, input in enumerate(pairsum_input):
+    # Number of candidate pairs per worker task, based on the number of 
+    # records, and per batch of tasks, based on the number of workers
+    task_size = multi.task_size(y_rows.shape[0])
+    chunk_size = task_size * cpu_count() * 4
+    
+    # Memory budget for each worker's cache of rowsum vectors
+    cache_bytes = 2**26
+    
+    # Empty dict to hold the best combos from each run
+    top_performers = {}
+    
+    # Picking up any runs that finished before a restart, as long as they
+    # were made with the same settings and data
+    if CHECKPOINT:
+        ckpt_key = tools.fingerprint(symptom_list, c_min, c_max, DEDUP,
+                                     mcs, best_n, X_bits, y_bits, planes)
+        ckpt = tools.checkpoint(file_dir + 'meta_checkpoints/', ckpt_key)
+        top_performers = ckpt.load_all()
+    
+    # Getting the side counts for every m in one pass over each combo's
+    # columns, instead of once per m-pair
+    if PRUNE:
+        max_m = np.max(mcs)
+        side_tp, side_fp = tools.side_count_table(X_bits, y_bits, col_combos,
+                                                  max_m, planes)
+    
+    for run_num, mc in enumerate(mcs):
+        if run_num in top_performers:
+            print(str(run_num) + ' (done)')
+            continue
         print(run_num)
-        # Getting the rowsums for each of the combos
-        psums = p.starmap(tools.pairsum, input)
-        
-        # Converting the pair of rowsums to a single column based on 
-        # the specified logical criterium ('any', 'or', or 'and')
-        csums = p.map(tools.combo_sum, [ps for ps in psums])
+        # Keeping only the best_n pairs seen so far for each mode
+        top_and = tools.top_k(best_n)
+        top_any = tools.top_k(best_n)
         
-        # Calculating f1 score for each of the combo sums
-        and_f1s = p.starmap(f1_score, [(y, cs[:, 0]) for cs in csums])
-        any_f1s = p.starmap(f1_score, [(y, cs[:, 1]) for cs in csums])
+        # Streaming the valid pairs for this m-pair through in chunks, 
+        # optionally skipping the ones that can't make the cut
+        if PRUNE:
+            counts = [(side_tp[:, m], side_fp[:, m]) for m in mc]
+            pairs = tools.pruned_meta_pairs(col_combos, 
+                                            counts, 
+                                            n_pos, 
+                                            n_neg,
+                                            (top_and, top_any),
+                                            mc)
+        else:
+            pairs = tools.meta_pairs(col_combos, mc)
+        for chunk in tools.chunk_iter(pairs, chunk_size):
+            # Getting the rowsums for each of the combos, converting them 
+            # to a single column based on the specified logical criterium 
+            # ('any' or 'both'), and calculating the f1 scores, all in 
+            # the workers
+            input = [(shared.specs, task, mc, cache_bytes, DEDUP, c_max) 
+                     for task in tools.chunk_iter(chunk, task_size)]
+            f1s = p.starmap(multi.shared_meta_scores, input)
+            and_f1s = np.concatenate([f1[0] for f1 in f1s])
+            any_f1s = np.concatenate([f1[1] for f1 in f1s])
+            
+            # Updating the running lists of the best pairs, leaving out the
+            # duplicate rules that weren't scored
+            for scores, top in [(and_f1s, top_and), (any_f1s, top_any)]:
+                scored = np.where(~np.isnan(scores))[0]
+                top.push_many(scores[scored], [chunk[i] for i in scored])
         
         # Pulling out the best from each one
-        top_and = np.argsort(and_f1s)[::-1][0:best_n]
-        top_any = np.argsort(any_f1s)[::-1][0:best_n]
-        top_all = [top_and, top_any]
+        top_all = [top_and.best(), top_any.best()]
         modes = ['both', 'any']
         prefixes = ['both of ', 'any of ']
         
         # Running the full metrics on the best from each group
-        for j, top_idx in enumerate(top_all):
+        run_best = []
+        for j, top_pairs in enumerate(top_all):
             prefx = prefixes[j]
             mode = modes[j]
             group_best = []
             
-            for i in top_idx:
-                pair = input[i]
-                pair_cols = pair[1]
-                pair_m = pair[2]
+            for f1, pair_cols in top_pairs:
+                pair_m = mc
                 
                 # Making the string specifying the condition
                 colnames = []
@@ -183,16 +320,34 @@ if RUN_META:
                 s1 = prefx + str(pair_m[0]) + ' from [' + str(colnames[0])
                 s2 = '] and ' + str(pair_m[1]) + ' from [' + str(colnames[1])
                 s = s1 + s2 + ']'
-                mtx = tools.combo_metrics(X, y, pair_cols, pair_m, mode)
+                mtx = tools.combo_metrics(X_rows, y_rows, 
+                                          pair_cols, pair_m, mode,
+                                          weights=w_rows)
                 mtx['cond'] = s
                 group_best.append(mtx)
             
             # Adding the results to the list
-            top_performers.append(pd.concat(group_best, axis=0))
+            if len(group_best) > 0:
+                run_best.append(pd.concat(group_best, axis=0))
         
-        # Writing results for the top combos to disk
-        top_df = pd.concat(top_performers, axis=0)
-        top_df.to_csv(file_dir + 'metacombo_stats.csv', index=False)
+        # Saving the run's results
+        top_performers[run_num] = None
+        if len(run_best) > 0:
+            top_performers[run_num] = pd.concat(run_best, axis=0)
+        if CHECKPOINT:
+            ckpt.save(run_num, top_performers[run_num])
+        
+        # Writing results for the top combos to disk in run order
+        run_dfs = [top_performers[r] for r in sorted(top_performers)
+                   if top_performers[r] is not None]
+        if len(run_dfs) > 0:
+            top_df = pd.concat(run_dfs, axis=0)
+            top_df.to_csv(file_dir + 'metacombo_stats.csv', index=False)
+    
+    shared.close()
+
+# Shutting down the workers
+p.close()
 
 # Bringing in the metacombination results
 mc_df = pd.read_csv(file_dir + 'top_meta.csv')
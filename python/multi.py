@@ -3,45 +3,297 @@
 import pandas as pd
 import numpy as np
 
-from sklearn.metrics import confusion_matrix, roc_curve
+from sklearn.metrics import confusion_matrix
 from sklearn.model_selection import StratifiedKFold, cross_val_predict
-from scipy.stats import chi2, norm
+from scipy.stats import chi2
 from copy import deepcopy
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 
 import tools
 
 
+class worker_pool:
+    '''Wrapper for a multiprocessing.Pool that can be passed to the functions
+    in this module and reused across calls, so the workers are only spawned
+    once. The Pool is started on first use and shut down by close() or on 
+    leaving a with block.
+    
+    Attributes:
+      n_workers: the number of worker processes (None for one per core)
+      pool: the multiprocessing.Pool, or None if it isn't running
+    '''
+    
+    def __init__(self, n_workers=None):
+        self.n_workers = n_workers
+        self.pool = None
+        return
+    
+    def get(self):
+        '''Returns the running Pool, starting it if need be.'''
+        if self.pool is None:
+            self.pool = Pool(self.n_workers)
+        return self.pool
+    
+    def map(self, func, inputs, chunksize=None):
+        '''Runs Pool.map() on the workers.'''
+        return self.get().map(func, inputs, chunksize)
+    
+    def starmap(self, func, inputs, chunksize=None):
+        '''Runs Pool.starmap() on the workers.'''
+        return self.get().starmap(func, inputs, chunksize)
+    
+    def close(self):
+        '''Shuts the workers down, waiting for them to finish.'''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+# Shared-memory blocks this process has attached to, by block name
+ATTACHED = {}
+
+# This process's tools.rowsum_cache, by the name of the block it reads from
+ROWSUM_CACHE = {}
+
+
+class shared_arrays:
+    '''Copies a set of arrays into shared memory once, so Pool workers can 
+    read them without having them pickled into every task. Tasks only need
+    to carry the specs, which workers pass to get_shared().
+    
+    Attributes:
+      specs: the (block name, shape, dtype) of each array, by array name
+      blocks: the multiprocessing.shared_memory blocks holding the arrays
+    '''
+    
+    def __init__(self, **arrays):
+        '''Copies the arrays into shared memory.
+        
+        Parameters
+          arrays: the arrays to share, by name (numeric, not object, dtypes)
+        '''
+        # Importing here, since shared_memory needs Python 3.8 or later
+        from multiprocessing import shared_memory
+        
+        self.specs = {}
+        self.blocks = []
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            assert arr.dtype != object, 'Cannot share object arrays.'
+            shm = shared_memory.SharedMemory(create=True, 
+                                             size=max(arr.nbytes, 1))
+            shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            shared[...] = arr
+            self.blocks.append(shm)
+            self.specs[name] = (shm.name, arr.shape, arr.dtype.str)
+        
+        return
+    
+    def close(self):
+        '''Frees the shared memory blocks.'''
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_shared(specs):
+    '''Attaches to the arrays in a shared_arrays object as read-only views.
+    
+    Parameters
+      specs: the specs attribute of a shared_arrays object (dict)
+    
+    Returns
+      a dict of the arrays, by name
+    '''
+    from multiprocessing import shared_memory
+    
+    # Letting go of blocks from earlier calls so their memory can be freed
+    current = [spec[0] for spec in specs.values()]
+    for block in list(ATTACHED.keys()):
+        if block not in current:
+            try:
+                ATTACHED[block].close()
+                del ATTACHED[block]
+            except BufferError:
+                pass
+    
+    # Attaching to the blocks, reusing attachments from earlier tasks
+    arrays = {}
+    for name, (block, shape, dtype) in specs.items():
+        if block not in ATTACHED:
+            ATTACHED[block] = shared_memory.SharedMemory(name=block)
+        arr = np.ndarray(shape, dtype=dtype, buffer=ATTACHED[block].buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+    
+    return arrays
+
+
+def get_rowsum_cache(specs, max_bytes=2**26):
+    '''Returns this process's tools.rowsum_cache for the shared packed 
+    matrix 'X_bits', starting a new one if the matrix has changed.'''
+    block = specs['X_bits'][0]
+    if block not in ROWSUM_CACHE:
+        ROWSUM_CACHE.clear()
+        bits = get_shared(specs)['X_bits']
+        ROWSUM_CACHE[block] = tools.rowsum_cache(bits, max_bytes)
+    cache = ROWSUM_CACHE[block]
+    cache.max_bytes = max_bytes
+    return cache
+
+
+def shared_meta_scores(specs, 
+                       pairs, 
+                       min=(1, 1), 
+                       cache_bytes=2**26,
+                       dedup=False,
+                       c_max=None):
+    '''Scores a chunk of metacombo pairs against the shared packed matrix 
+    'X_bits' and labels 'y_bits', running the pair sums, combo sums, and F1
+    scores all in the worker so only the scores go back to the parent. The
+    rowsums for each side are memoized across tasks in a tools.rowsum_cache.
+    If the shared arrays include 'planes', the rows are weighted by them 
+    (e.g., for a tools.pattern_table()).
+    
+    Parameters
+      specs: the specs attribute of a shared_arrays object (dict)
+      pairs: the pairs of column combos to score (list)
+      min: a tuple of minimum counts for the two combos in each pair
+      cache_bytes: the memory budget for the worker's rowsum cache (int)
+      dedup: whether to skip rules not in tools.canonical_meta() form (bool)
+      c_max: the largest number of columns allowed on a side (int)
+    
+    Returns
+      both_f1s, any_f1s: the F1 scores for the 'both' and 'any' modes, with
+        NaN for the rules that were skipped (arrs)
+    '''
+    arrays = get_shared(specs)
+    y_bits = arrays['y_bits']
+    planes = arrays.get('planes')
+    cache = get_rowsum_cache(specs, cache_bytes)
+    
+    # Figuring out which pairs to score in each mode
+    n_pairs = len(pairs)
+    keep_both = np.ones(n_pairs, dtype=bool)
+    keep_any = np.ones(n_pairs, dtype=bool)
+    if dedup:
+        keep_both = np.array([tools.is_canonical(c, min, 'both', c_max)
+                              for c in pairs], dtype=bool)
+        keep_any = np.array([tools.is_canonical(c, min, 'any', c_max)
+                             for c in pairs], dtype=bool)
+    
+    # Getting the combo sums for the pairs that need them
+    csums = [tools.packed_combo_sum(cache.pairsum(pairs[i], min))
+             for i in np.where(keep_both | keep_any)[0]]
+    csums = np.array(csums).reshape(-1, 2, y_bits.shape[0])
+    both_bits = csums[keep_both[keep_both | keep_any], 0]
+    any_bits = csums[keep_any[keep_both | keep_any], 1]
+    
+    # And then the f1 scores
+    both_f1s = np.full(n_pairs, np.nan)
+    any_f1s = np.full(n_pairs, np.nan)
+    both_f1s[keep_both] = tools.packed_f1(y_bits, both_bits, planes)
+    any_f1s[keep_any] = tools.packed_f1(y_bits, any_bits, planes)
+    return both_f1s, any_f1s
+
+
+def task_size(n_records, 
+              work=2**27, 
+              min_size=16, 
+              max_size=10000):
+    '''Picks the number of candidates to put in each worker task, so each 
+    task covers roughly the same number of record evaluations no matter how
+    big the dataset is.
+    
+    Parameters
+      n_records: the number of records each candidate is evaluated on (int)
+      work: the target number of record evaluations per task (int)
+      min_size: the smallest number of candidates per task (int)
+      max_size: the largest number of candidates per task (int)
+    
+    Returns
+      the number of candidates per task (int)
+    '''
+    size = work // np.maximum(n_records, 1)
+    return int(np.clip(size, min_size, max_size))
+
+
+def group_codes(by):
+    '''Swaps group IDs for integer codes (in sorted order of the IDs), so
+    they can go into shared memory or be used as indices.'''
+    return np.unique(by, return_inverse=True)[1]
+
+
 def jackknife_metrics(targets,
                       guesses,
                       average_by=None,
-                      weighted=True):
+                      weighted=True,
+                      mcnemar=False):
     '''Produces jackknife (leave-one-out) scores and means for the output of
-    tools.clf_metrics(). 
+    tools.clf_metrics(). These come in closed form from 
+    tools.cell_jackknife(), or, with macro averaging, from taking each 
+    record out of its group's 2x2 table.
     
     Parameters
       targets: the true labels (arr of {0, 1})
       guesses: the predicted labels (arr of {0, 1})
       average_by: the variable to use for macro averaging (1-d array)
       weighted: whether to weight macro averaging (bool)
+      mcnemar: whether to add p-values from McNemar's test (bool; always
+        added with macro averaging, like tools.macro_clf_metrics())
     
     Returns
       scores, means: the jackknife scores and their means
     '''
-    # Replicates of the dataset with one row missing from each
-    rows = np.array(list(range(targets.shape[0])))
-    j_rows = [np.delete(rows, row) for row in rows]
-    
-    # using a pool to get the metrics across each
-    inputs = [(targets[idx], guesses[idx], average_by, weighted)
-              for idx in j_rows]
-    p = Pool()
-    stat_list = p.starmap(tools.clf_metrics, inputs)
-    p.close()
-    p.join()
-    
-    # Combining the jackknife metrics and getting their means
-    scores = pd.concat(stat_list, axis=0)
+    if average_by is None:
+        # Expanding the (at most) 4 distinct replicates to one per record
+        cell_stats, counts, cells = tools.cell_jackknife(targets, 
+                                                         guesses,
+                                                         mcnemar=mcnemar)
+        scores = cell_stats.iloc[cells]
+        scores.index = np.zeros(len(cells), dtype=np.int64)
+        
+        # Getting the means by weighting each replicate by its cell count,
+        # skipping NaNs the same way pd.DataFrame.mean() does
+        vals = cell_stats.values
+        w = counts.reshape(-1, 1) * ~np.isnan(vals)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.nansum(vals * w, axis=0) / np.sum(w, axis=0)
+        means = pd.Series(means, index=cell_stats.columns)
+        return scores, means
+    
+    # Leaving out a record only takes 1 away from its cell in its group's
+    # 2x2 table, so there's one distinct replicate per group and cell
+    cells = 2 * np.array(targets, dtype=np.int64)
+    cells += np.array(guesses, dtype=np.int64)
+    codes = group_codes(average_by)
+    counts = tools.group_cell_counts(cells, codes)
+    n_groups = counts.shape[0]
+    reps = np.repeat(counts[None], 4 * n_groups, axis=0)
+    reps = reps.reshape(n_groups, 4, n_groups, 4)
+    for g in range(n_groups):
+        reps[g, :, g] -= np.eye(4, dtype=np.int64)
+    rep_stats = tools.macro_metrics(reps.reshape(4 * n_groups, n_groups, 4),
+                                    weighted=weighted)
+    
+    # Expanding the replicates to one per record and getting their means
+    scores = pd.DataFrame(rep_stats[4 * codes + cells],
+                          columns=tools.METRIC_COLS + ['mcnemar'],
+                          index=np.zeros(len(cells), dtype=np.int64))
     means = scores.mean()
     return scores, means
 
@@ -52,6 +304,8 @@ class boot_cis:
     Attributes:
       cis: confidence intervals
       scores: observed metrics for each bootstrap sample
+      n_boot: the number of bootstrap samples used
+      mc_se: Monte Carlo standard errors for the lower and upper bounds
     '''
     
     def __init__(self,
@@ -65,7 +319,9 @@ class boot_cis:
                  average_by=None,
                  weighted=True,
                  mcnemar=False,
-                 seed=10221983):
+                 seed=10221983,
+                 tol=None,
+                 batch_size=1000):
         '''Produces bootstrap confidence intervals for binary classification
         metrics produced by tools.clf_metrics(). 
         
@@ -73,14 +329,20 @@ class boot_cis:
           targets: the true labels (arr of {0, 1})
           guesses: the predicted labels (arr of {0, 1})
           sample_by: group IDs to be used for sampling (1-d array)
-          n: number of bootstrap samples to compute (int)
+          n: number of bootstrap samples to compute, or the most to compute
+            when tol is set (int)
           a: significance level for the intervals (float from 0 to 1)
           method: interval method; options are 'diff', 'pct', and 'bca'
           interpolation: interpolation method for np.quantile
           average_by: the variable to use for macro averaging
           weighted: whether to weight macro averaging (bool)
           mcnemar: whether to return a p-value from McNemar's test (bool)
-          seed: seed to use for generating bootstrap seeds (int)     
+          seed: root seed for the bootstrap samples' streams (int)
+          tol: the largest Monte Carlo standard error to allow for the 
+            bounds (float), or None to always draw n samples; with a 
+            tolerance, samples are drawn batch_size at a time until the 
+            bounds pass mc_converged(), or until n are drawn
+          batch_size: number of samples to draw at a time when tol is set
         '''
         # Converting everything to NumPy arrays, just in case
         stype = type(pd.Series())
@@ -91,6 +353,10 @@ class boot_cis:
         if type(guesses) == stype:
             guesses = guesses.values
         
+        # Making sure a valid method was chosen
+        methods = ['pct', 'diff', 'bca']
+        assert method in methods, 'Method must be pct, diff, or bca.'
+        
         # Getting the point estimates
         stat = tools.clf_metrics(targets,
                                  guesses,
@@ -98,158 +364,287 @@ class boot_cis:
                                  weighted=weighted,
                                  mcnemar=mcnemar).transpose()
         
-        # Pulling out the column names to pass to the bootstrap dataframes
-        colnames = list(stat.index.values)
+        # Estiamating the acceleration factor for BCa intervals, which 
+        # doesn't depend on the bootstrap samples
+        acc = None
+        if method == 'bca':
+            j = jackknife_metrics(targets, 
+                                  guesses,
+                                  average_by=average_by,
+                                  weighted=weighted,
+                                  mcnemar=mcnemar)
+            acc = tools.jack_acc((j[1] - j[0]).values[None])[0]
+            self.jack = j
         
-        # Making an empty holder for the output
-        scores = pd.DataFrame(np.zeros(shape=(n, stat.shape[0])),
-                              columns=colnames)
-        
-        # Setting the seed
-        if seed is None:
-            seed = np.random.randint(0, 1e6, 1)
-        np.random.seed(seed)
-        seeds = np.random.randint(0, 1e6, n)
-        
-        # Generating the bootstrap samples and metrics
-        p = Pool()
-        boot_input = [(targets, sample_by, None, seed) for seed in seeds]
-        boots = p.starmap(tools.boot_sample, boot_input)
-        
-        if average_by is not None:
-            inputs = [(targets[boot],
-                       guesses[boot],
-                       average_by[boot],
-                       weighted)
-                      for boot in boots]
-        else:
-            inputs = [(targets[boot], guesses[boot]) for boot in boots]
-        
-        # Getting the bootstrapped metrics from the Pool
-        p_output = p.starmap(tools.clf_metrics, inputs)
-        scores = pd.concat(p_output, axis=0)
-        p.close()
-        p.join()
-        
-        # Calculating the confidence intervals
-        lower = (a / 2) * 100
-        upper = 100 - lower
+        # Spawning an independent random stream for each bootstrap sample
+        seeds = tools.boot_seeds(seed, n)
+        draw_args = (targets, 
+                     guesses, 
+                     sample_by, 
+                     average_by, 
+                     weighted, 
+                     mcnemar)
         
-        # Making sure a valid method was chosen
-        methods = ['pct', 'diff', 'bca']
-        assert method in methods, 'Method must be pct, diff, or bca.'
+        if tol is None:
+            scores = self._draw(seeds, *draw_args)
+            self._get_cis(stat, scores, a, method, interpolation, acc)
+            return
         
-        # Calculating the CIs with method #1: the percentiles of the 
-        # bootstrapped statistics
-        if method == 'pct':
-            cis = np.nanpercentile(scores, 
-                                   q=(lower, upper),
-                                   interpolation=interpolation, 
-                                   axis=0)
-            cis = pd.DataFrame(cis.transpose(),
-                               columns=['lower', 'upper'],
-                               index=colnames)
-        
-        # Or with method #2: the percentiles of the difference between the
-        # obesrved statistics and the bootstrapped statistics
-        elif method == 'diff':
-            stat_vals = stat.transpose().values.ravel()
-            diffs = stat_vals - scores
-            percents = np.nanpercentile(diffs,
-                                        q=(lower, upper),
-                                        interpolation=interpolation,
-                                        axis=0)
-            lower_bound = pd.Series(stat_vals + percents[0])
-            upper_bound = pd.Series(stat_vals + percents[1])
-            cis = pd.concat([lower_bound, upper_bound], axis=1)
-            cis = cis.set_index(stat.index)
-        
-        # Or with method #3: the bias-corrected and accelerated bootstrap
-        elif method == 'bca':
-            # Calculating the bias-correction factor
-            stat_vals = stat.transpose().values.ravel()
-            n_less = np.sum(scores < stat_vals, axis=0)
-            p_less = n_less / n
-            z0 = norm.ppf(p_less)
-            
-            # Fixing infs in z0
-            z0[np.where(np.isinf(z0))[0]] = 0.0
-            
-            # Estiamating the acceleration factor
-            j = jackknife_metrics(targets, guesses)
-            diffs = j[1] - j[0]
-            numer = np.sum(np.power(diffs, 3))
-            denom = 6 * np.power(np.sum(np.power(diffs, 2)), 3/2)
-            
-            # Getting rid of 0s in the denominator
-            zeros = np.where(denom == 0)[0]
-            for z in zeros:
-                denom[z] += 1e-6
-            
-            # Finishing up the acceleration parameter
-            acc = numer / denom
-            self.jack = j
-            
-            # Calculating the bounds for the confidence intervals
-            zl = norm.ppf(a / 2)
-            zu = norm.ppf(1 - (a/2))
-            lterm = (z0 + zl) / (1 - acc*(z0 + zl))
-            uterm = (z0 + zu) / (1 - acc*(z0 + zu))
-            lower_q = norm.cdf(z0 + lterm) * 100
-            upper_q = norm.cdf(z0 + uterm) * 100
-            self.lower_q = lower_q
-            self.upper_q = upper_q
-            
-            # Returning the CIs based on the adjusted quintiles
-            cis = [np.nanpercentile(scores.iloc[:, i], 
-                                    q=(lower_q[i], upper_q[i]),
-                                    interpolation=interpolation, 
-                                    axis=0) 
-                   for i in range(len(lower_q))]
-            cis = pd.DataFrame(cis,
-                               columns=['lower', 'upper'],
-                               index=colnames)
+        # Or drawing the samples in batches until the bounds settle down;
+        # the first m samples are always the same for a given seed, so 
+        # stopping early gives the same CIs as setting n=m
+        batches = []
+        for start in range(0, n, batch_size):
+            batches.append(self._draw(seeds[start:start + batch_size],
+                                      *draw_args))
+            scores = pd.concat(batches, axis=0)
+            self._get_cis(stat, scores, a, method, interpolation, acc)
+            if mc_converged(self.mc_se, tol):
+                break
         
+        return
+    
+    def _draw(self,
+              seeds, 
+              targets, 
+              guesses, 
+              sample_by, 
+              average_by, 
+              weighted,
+              mcnemar):
+        '''Gets the metrics for the bootstrap samples from a set of seeds.'''
+        # The metrics for all the bootstrap samples come straight from 
+        # their 2x2 counts, kept by group when they're macro-averaged
+        scores = tools.boot_metrics(targets, 
+                                    guesses, 
+                                    seeds, 
+                                    by=sample_by,
+                                    average_by=average_by,
+                                    weighted=weighted,
+                                    mcnemar=mcnemar)
+        columns = tools.METRIC_COLS
+        if mcnemar or average_by is not None:
+            columns = columns + ['mcnemar']
+        scores = pd.DataFrame(scores,
+                              columns=columns,
+                              index=np.zeros(len(seeds), dtype=np.int64))
+        return scores
+    
+    def _get_cis(self, stat, scores, a, method, interpolation, acc=None):
+        '''Calculates the CIs and their Monte Carlo errors from the 
+        bootstrap scores and passes them back up to the class.
+        '''
+        if acc is not None:
+            acc = acc[None]
+        out = tools.boot_intervals(stat.transpose().values,
+                                   scores.values[None],
+                                   a=a,
+                                   method=method,
+                                   interpolation=interpolation,
+                                   acc=acc)
+        self._set_cis(stat, scores, method, *[o[0] for o in out])
+        return
+    
+    def _set_cis(self, stat, scores, method, bounds, mc_se, levels):
+        '''Passes the output from tools.boot_intervals() for a single rule 
+        back up to the class.
+        '''
         # Putting the stats with the lower and upper estimates
+        colnames = list(stat.index.values)
+        cis = pd.DataFrame(bounds,
+                           columns=['lower', 'upper'],
+                           index=colnames)
         cis = pd.concat([stat, cis], axis=1)
         cis.columns = ['stat', 'lower', 'upper']
         
         # Passing the results back up to the class
         self.cis = cis
         self.scores = scores
+        self.n_boot = scores.shape[0]
+        self.mc_se = pd.DataFrame(mc_se,
+                                  columns=['lower', 'upper'],
+                                  index=colnames)
+        if method == 'bca':
+            self.lower_q = levels[:, 0]
+            self.upper_q = levels[:, 1]
         
         return
 
 
+def mc_converged(mc_se, tol):
+    '''Checks whether the Monte Carlo standard errors for a set of CIs are
+    all within a tolerance. The metrics that are counts (the 2x2 cells and
+    the prevalences) are skipped, since they're on a different scale from
+    the others, and so are NaNs.
+    
+    Parameters
+      mc_se: the boot_cis.mc_se for the CIs (pd.DataFrame)
+      tol: the largest standard error to allow (float)
+    
+    Returns
+      True if every standard error is within the tolerance, else False
+    '''
+    counts = ['tp', 'fp', 'tn', 'fn', 'true_prev', 'pred_prev', 'prev_diff']
+    se = mc_se.drop(counts, errors='ignore').values
+    return bool(np.all(np.isnan(se) | (se <= tol)))
+
+
+def multi_boot_cis(targets,
+                   guesses,
+                   sample_by=None,
+                   n=100,
+                   a=0.05,
+                   method='bca',
+                   interpolation='nearest',
+                   seed=10221983,
+                   tol=None,
+                   batch_size=1000):
+    '''Runs boot_cis() for a set of rules at once. The bootstrap samples are
+    drawn once and all the rules are scored against them in a single pass, 
+    which gives the same results as calling boot_cis() on each rule with 
+    the same seed.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      guesses: the predicted labels, with one column per rule (2-d array or
+        pd.DataFrame of {0, 1})
+      sample_by: group IDs to be used for sampling (1-d array)
+      n: number of bootstrap samples to compute, or the most to compute
+        when tol is set (int)
+      a: significance level for the intervals (float from 0 to 1)
+      method: interval method; options are 'diff', 'pct', and 'bca'
+      interpolation: interpolation method for np.quantile
+      seed: root seed for the bootstrap samples' streams (int)
+      tol: the largest Monte Carlo standard error to allow for each rule's
+        bounds (float), or None to always draw n samples; rules stop 
+        getting new samples as soon as their bounds are within it
+      batch_size: number of samples to draw at a time when tol is set
+    
+    Returns
+      a list of boot_cis objects, one per rule
+    '''
+    # Converting everything to NumPy arrays, just in case
+    if type(sample_by) == type(pd.Series()):
+        sample_by = sample_by.values
+    targets = np.array(targets)
+    guesses = np.array(guesses)
+    n_rules = guesses.shape[1]
+    
+    # Getting the point estimates and, for BCa intervals, the 
+    # acceleration factors, which don't depend on the bootstrap samples;
+    # the boot_cis objects start out empty, since their CIs are filled in
+    # for all the rules at once below
+    out = [boot_cis.__new__(boot_cis) for r in range(n_rules)]
+    stats = [tools.clf_metrics(targets, guesses[:, r]).transpose()
+             for r in range(n_rules)]
+    stat_vals = np.stack([stat.values.ravel() for stat in stats])
+    accs = None
+    if method == 'bca':
+        for r in range(n_rules):
+            out[r].jack = jackknife_metrics(targets, guesses[:, r])
+        accs = tools.jack_acc(np.stack([(ci.jack[1] - ci.jack[0]).values
+                                        for ci in out]))
+    
+    # Spawning an independent random stream for each bootstrap sample
+    seeds = tools.boot_seeds(seed, n)
+    if tol is None:
+        batch_size = n
+    
+    # Drawing the samples in batches for the rules that still need them
+    active = np.arange(n_rules)
+    scores = np.zeros((n_rules, 0, len(tools.METRIC_COLS)))
+    for start in range(0, n, batch_size):
+        batch = seeds[start:start + batch_size]
+        counts = tools.boot_counts(targets, 
+                                   guesses[:, active], 
+                                   batch, 
+                                   by=sample_by).reshape(-1, 4)
+        
+        # Turning the counts into metrics for all the rules at once
+        batch_scores = tools.count_metrics(tp=counts[:, 3],
+                                           fp=counts[:, 1],
+                                           tn=counts[:, 0],
+                                           fn=counts[:, 2]).values
+        batch_scores = batch_scores.reshape(len(batch), len(active), -1)
+        scores = np.concatenate([scores, batch_scores.swapaxes(0, 1)],
+                                axis=1)
+        
+        # And getting all of their CIs in one go
+        bounds, mc_se, levels = tools.boot_intervals(
+            stat_vals[active],
+            scores,
+            a=a,
+            method=method,
+            interpolation=interpolation,
+            acc=None if accs is None else accs[active]
+        )
+        
+        # Passing the results back up to each rule's boot_cis
+        keep = []
+        for i, r in enumerate(active):
+            rule_scores = pd.DataFrame(scores[i],
+                                       columns=tools.METRIC_COLS,
+                                       index=np.zeros(scores.shape[1],
+                                                      dtype=np.int64))
+            out[r]._set_cis(stats[r], 
+                            rule_scores, 
+                            method, 
+                            bounds[i], 
+                            mc_se[i], 
+                            levels[i])
+            keep.append(tol is None or not mc_converged(out[r].mc_se, tol))
+        
+        active = active[keep]
+        scores = scores[keep]
+        if len(active) == 0:
+            break
+    
+    return out
+
+
 def boot_roc(targets,
              scores,
              sample_by=None,
              n=1000,
-             seed=10221983):
+             seed=10221983,
+             pool=None,
+             grid=None):
     '''Returns ROC curves for bootstrap samples of predicted scores, e.g.,
-    from a scikit-learn random forest or SVM.
+    from a scikit-learn random forest or SVM. The curves come from 
+    tools.boot_roc_curves(), which only sorts the scores once, and are put
+    on a common grid of false positive rates so they can be stacked.
     
     Parameters
       targets: the true labels (arr of {0, 1})
       scores: predicted positive probabilities (arr of {0, 1})
       sample_by: group ID to be used for sampling (arr)
       n: number of bootstrap samples to compute (int)
-      seed: initial seed to use for generating bootstrap samples (int)
+      seed: root seed for the bootstrap samples' streams (int)
+      pool: the worker_pool to split the samples across, if any (None to
+        run them all here)
+      grid: the false positive rates to put the curves on (1-d array, or
+        None for 0 to 1 in steps of .01)
     
     Returns
-      a list of scikit-learn roc_curves
+      grid: the false positive rates for the curves
+      tprs: the true positive rates, with shape (n, len(grid))
+      aucs: the area under each sample's curve
     '''
-    # Generating the seeds
-    np.random.seed(seed)
-    seeds = np.random.randint(1, 1e7, n)
-    
-    # Getting the indices for the bootstrap samples
-    p = Pool()
-    boot_input = [(targets, sample_by, None, seed) for seed in seeds]
-    boots = p.starmap(tools.boot_sample, boot_input)
-    
-    # Getting the ROC curves
-    roc_input = [(targets[boot], scores[boot]) for boot in boots]
-    rocs = p.starmap(roc_curve, roc_input)
+    # Spawning an independent random stream for each bootstrap sample
+    seeds = tools.boot_seeds(seed, n)
+    if pool is None:
+        return tools.boot_roc_curves(targets, 
+                                     scores, 
+                                     seeds, 
+                                     by=sample_by, 
+                                     grid=grid)
     
-    return rocs
+    # Or giving each worker an even share of the samples
+    n_chunks = pool.n_workers if pool.n_workers is not None else cpu_count()
+    chunks = np.array_split(np.arange(n), n_chunks)
+    inputs = [(targets, scores, [seeds[i] for i in chunk], sample_by, grid)
+              for chunk in chunks if len(chunk) > 0]
+    p_output = pool.starmap(tools.boot_roc_curves, inputs)
+    tprs = np.concatenate([out[1] for out in p_output], axis=0)
+    aucs = np.concatenate([out[2] for out in p_output])
+    return p_output[0][0], tprs, aucs
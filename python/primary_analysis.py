@@ -12,9 +12,7 @@ multiprocessing.
 import numpy as np
 import pandas as pd
 import itertools
-import pickle
 
-from multiprocessing import Pool
 from sklearn.metrics import f1_score
 
 import tools
@@ -30,6 +28,10 @@ OMIT_DISC = True
 # Number of bootstrap samples to take for calculating CIs
 N_BOOT = 10000
 
+# Largest Monte Carlo standard error to allow for the CI bounds; with a 
+# tolerance, N_BOOT is the most samples a rule will get (None for no limit)
+BOOT_TOL = None
+
 # Significance level to use for statistical testing
 ALPHA = 0.05
 
@@ -61,7 +63,7 @@ if OMIT_DISC:
     concordants = np.where([not (records.pcr_pos[i] == 0
                             and records.sero_pos[i] ==1)
                             for i in range(records.shape[0])])[0]
-    records = records.iloc[concordants, :]
+    records = records.iloc[concordants, :].reset_index(drop=True)
 
 # List of symptom names and case definitions
 symptom_list = [
@@ -93,9 +95,6 @@ strata = [(X_list[i], y_list[i]) for i in range(len(X_list))]
 strata_idx = [np.array(list(range(X.shape[0]))), adults, kids]
 strata_names = ['all', 'adults', 'kids']
 
-# Initializing a multiprocessing.Pool to help with the calculations
-p = Pool()
-
 # Making an empty list to hold the stratum-specific CIs
 ci_dfs = []
 
@@ -112,28 +111,26 @@ for i, idx in enumerate(strata_idx):
     
     # Running the loop
     single_counts = []
-    single_cis = []
     all_rules = tools.flatten(rule_lists)
     
     for rule in all_rules:
         # Getting the cell counts for the 2x2 table
         stat = tools.clf_metrics(y[idx], 
-                                 records[rule][idx])
+                                 records[rule].values[idx])
         counts = stat[['tp', 'fp', 'tn', 'fn']]
         single_counts.append(counts)
-        
-        # And now calculating the bootstrap CI
-        ci = multi.boot_cis(targets=y[idx], 
-                            guesses=records[rule][idx], 
-                            sample_by=records.hh_id[idx],
-                            n=N_BOOT, 
-                            a=alpha)
-        single_cis.append(ci)
     
-    #Pickling the CIs for later
-    with open(file_dir + s_name + '_cis.pkl', 'wb') as f:
-        pickle.dump(single_cis, f)
-        f.close()
+    # And now calculating the bootstrap CIs, drawing the household samples
+    # once for all of the rules
+    single_cis = multi.multi_boot_cis(targets=y[idx],
+                                      guesses=records[all_rules].values[idx],
+                                      sample_by=records.hh_id.values[idx],
+                                      n=N_BOOT,
+                                      a=alpha,
+                                      tol=BOOT_TOL)
+    
+    # Saving the CIs and bootstrap scores for later
+    tools.save_boot_cis(file_dir + s_name + '_cis/', single_cis, all_rules)
     
     # Isolating the dx and prev metrics and reshaping the CIs
     all_cis = []
@@ -156,6 +153,12 @@ for i, idx in enumerate(strata_idx):
             'prev_diff', 'prev_diff.lower', 'prev_diff.upper' 
         ]
         out_df['rule'] = all_rules[j]
+        
+        # Noting how many samples the CIs took and how precise they are
+        mc_se = single_cis[j].mc_se.loc[['sens', 'spec', 'ppv', 'npv', 
+                                         'j', 'f1', 'rel_prev_diff']]
+        out_df['n_boot'] = single_cis[j].n_boot
+        out_df['mc_se'] = np.nanmax(mc_se.values).round(ROUND + 1)
         all_cis.append(out_df)
     
     all_cis = pd.concat(all_cis, axis=0)
@@ -184,17 +187,12 @@ if EXCEL:
     writer.save()
 
 # Loading the adult and kid CIs 
-with open(file_dir + 'adults_cis.pkl', 'rb') as f:
-    adult_cis = pickle.load(f)
-    f.close()
-
-with open(file_dir + 'kids_cis.pkl', 'rb') as f:
-    kid_cis = pickle.load(f)
-    f.close()
+adult_cis = tools.boot_store(file_dir + 'adults_cis/')
+kid_cis = tools.boot_store(file_dir + 'kids_cis/')
 
 # Getting the diff CIs
-diff_cis = [tools.diff_boot_cis(kid_cis[i], adult_cis[i]) 
-            for i in range(len(adult_cis))]
+diff_cis = [tools.diff_boot_cis(kid_cis[rule], adult_cis[rule]) 
+            for rule in all_rules]
 
 # Saving the full diff CIs to disk
 if EXCEL:
@@ -212,10 +210,10 @@ slim_diffs = np.zeros(shape=(len(all_rules), 7))
 slim_diffs = pd.DataFrame(slim_diffs, columns=slim_cols)
 
 # Recalculating the CIs for sens and spec with adjusted alpha
-slim_cis = [tools.diff_boot_cis(kid_cis[i],
-                                adult_cis[i],
+slim_cis = [tools.diff_boot_cis(kid_cis[rule],
+                                adult_cis[rule],
                                 a=ALPHA/2) 
-            for i in range(len(adult_cis))]
+            for rule in all_rules]
 
 # Filling in the table
 for i, df in enumerate(slim_cis):
@@ -2,11 +2,17 @@
 
 import pandas as pd
 import numpy as np
+import itertools
+import heapq
+import hashlib
+import json
+import os
 
 from sklearn.metrics import confusion_matrix
 from sklearn.model_selection import StratifiedKFold, cross_val_predict
 from scipy.stats import binom, chi2, norm
 from copy import deepcopy
+from collections import OrderedDict
 from multiprocessing import Pool
 
 
@@ -37,7 +43,7 @@ def mcnemar_test(targets, guesses, cc=True):
       'stat': chi-squared statistic
       'pval': p-value from the test
     '''
-    cm = confusion_matrix(true, pred)
+    cm = confusion_matrix(targets, guesses)
     b = int(cm[0, 1])
     c = int(cm[1, 0])
     if cc:
@@ -95,7 +101,9 @@ def clf_metrics(targets,
                 weighted=True,
                 round=4,
                 round_pval=False,
-                mcnemar=False):
+                mcnemar=False,
+                weights=None,
+                as_frame=True):
     '''Calculates a range of binary classification metrics for a set of class
     predictions relative to a reference standard.
     
@@ -107,6 +115,10 @@ def clf_metrics(targets,
       round: number of significant digits to report
       round_pval: whether to round p-values from McNemar's test (bool)
       mcnemar: whether to run McNemar's test
+      weights: the number of records each row stands for, e.g., from 
+        pattern_table() (arr of ints, or None for 1 each)
+      as_frame: whether to return a data frame or, for speed, just its 
+        values as a 1-d array (bool)
     
     Returns
       a one-row data frame with the following columns:
@@ -131,69 +143,37 @@ def clf_metrics(targets,
     '''
     
     # Converting pd.Series to np.array
-    stype = type(pd.Series())
-    if type(guesses) == stype:
+    if isinstance(guesses, pd.Series):
         guesses = guesses.values
-    if type(targets) == stype:
+    if isinstance(targets, pd.Series):
         targets = targets.values
-    if type(average_by) == stype:
-        average_by == average_by.values
+    if isinstance(average_by, pd.Series):
+        average_by = average_by.values
     
     # Optionally returning macro-average results
     if average_by is not None:
-        return macro_clf_metrics(targets=targets,
-                                 guesses=guesses,
-                                 by=average_by,
-                                 weighted=weighted,
-                                 round=round)
-    # Constructing the 2x2 table
-    confmat = confusion_matrix(targets, guesses)
-    tp = confmat[1, 1]
-    fp = confmat[0, 1]
-    tn = confmat[0, 0]
-    fn = confmat[1, 0]
-    
-    # Calculating basic measures of diagnostic accuracy
-    sens = np.round(tp / (tp + fn), round)
-    spec = np.round(tn / (tn + fp), round)
-    ppv = np.round(tp / (tp + fp), round)
-    npv = np.round(tn / (tn + fn), round)
-    f1 = np.round(2 * (sens * ppv) / (sens + ppv), round)
-    j = sens + spec - 1
-    mcc_num = ((tp * tn) - (fp * fn))
-    mcc_denom = np.sqrt(((tp+fp)*(tp+fn)*(tn+fp)*(tn+fn)))
-    mcc = mcc_num / mcc_denom
-    brier = np.round(brier_score(targets, guesses), round)
-    outmat = np.array([tp, fp, tn, fn,
-                       sens, spec, ppv,
-                       npv, j, f1, mcc, brier]).reshape(-1, 1)
-    out = pd.DataFrame(outmat.transpose(),
-                       columns=['tp', 'fp', 'tn', 
-                                'fn', 'sens', 'spec', 
-                                'ppv', 'npv', 'j', 
-                                'f1', 'mcc', 'brier'])
-    
-    # Calculating some additional measures based on positive calls
-    true_prev = int(np.sum(targets == 1))
-    pred_prev = int(np.sum(guesses == 1))
-    abs_diff = (true_prev - pred_prev) * -1
-    rel_diff = np.round(abs_diff / true_prev, round)
-    if mcnemar:
-        pval = mcnemar_test(targets, guesses).pval[0]
-        if round_pval:
-            pval = np.round(pval, round)
-    count_outmat = np.array([true_prev, pred_prev, abs_diff, 
-                             rel_diff]).reshape(-1, 1)
-    count_out = pd.DataFrame(count_outmat.transpose(),
-                             columns=['true_prev', 'pred_prev', 
-                                      'prev_diff', 'rel_prev_diff'])
-    out = pd.concat([out, count_out], axis=1)
-    
-    # Optionally dropping the mcnemar p-val
-    if mcnemar:
-        out['mcnemar'] = pval
+        out = macro_clf_metrics(targets=targets,
+                                guesses=guesses,
+                                by=average_by,
+                                weighted=weighted,
+                                round=round)
+        return out if as_frame else out.values[0]
     
-    return out
+    # Getting the metrics straight from the 2x2 counts, only building the 
+    # data frame when it's asked for
+    counts = clf_counts(targets, guesses, weights)
+    out = metric_array(tp=counts[3],
+                       fp=counts[1],
+                       tn=counts[0],
+                       fn=counts[2],
+                       round=round,
+                       mcnemar=mcnemar)
+    if mcnemar and round_pval:
+        out[:, -1] = np.round(out[:, -1], round)
+    if not as_frame:
+        return out[0]
+    columns = METRIC_COLS + ['mcnemar'] if mcnemar else METRIC_COLS
+    return pd.DataFrame(out, columns=columns)
 
 
 def macro_clf_metrics(targets,
@@ -218,64 +198,277 @@ def macro_clf_metrics(targets,
     Returns
       the df from clf_metrics() where everything has been averaged
     '''
-    # Column groups for rounding later
+    # Getting the 2x2 tables for all the groups with a single bincount
+    cells = 2 * np.asarray(targets, dtype=np.int64)
+    cells += np.asarray(guesses, dtype=np.int64)
+    counts = group_cell_counts(cells, np.asarray(by))
+    avg_stats = macro_metrics(counts,
+                              weighted=weighted,
+                              round=round,
+                              p_method=p_method,
+                              mcnemar=mcnemar)
+    
+    # Converting the count metrics back to integers
+    columns = METRIC_COLS + ['mcnemar'] if mcnemar else METRIC_COLS
+    avg_stats = pd.DataFrame(avg_stats.reshape(1, -1), columns=columns)
     count_cols = ['tp', 'fp', 'tn', 'fn']
-    prev_cols = ['true_prev', 'pred_prev', 'prev_diff']
+    avg_stats[count_cols] = avg_stats[count_cols].astype(int)
     
-    # Getting the indices for each group
-    n = len(targets)
-    group_names = np.unique(by)
-    n_groups = len(group_names)
-    group_idx = [np.where(by == group)[0]
-                 for group in group_names]
-    group_counts = np.array([len(idx) for idx in group_idx])
+    return avg_stats
+
+
+def macro_metrics(counts,
+                  weighted=True,
+                  round=4,
+                  p_method='harmonic',
+                  mcnemar=True):
+    '''Array version of macro_clf_metrics() that works straight from the 
+    per-group 2x2 tables, for any number of sets of groups at once (e.g., 
+    one per bootstrap sample). Groups with no records are left out of the 
+    averages.
+    
+    Parameters
+      counts: the 2x2 counts for each group in the order tn, fp, fn, tp 
+        (arr of shape (..., n_groups, 4))
+      weighted: whether to weight the groups by their sizes (bool)
+      round: number of significant digits to return
+      p_method: how to average p-values; may be 'harmonic' or 'fisher'
+      mcnemar: whether to run McNemar's test (bool)
+    
+    Returns
+      the averaged metrics (arr of shape (..., n_metrics)), with columns in 
+        the order of METRIC_COLS plus 'mcnemar' (when requested)
+    '''
+    # Column groups for rounding later
+    count_cols = [0, 1, 2, 3]
+    prev_cols = [12, 13, 14]
+    float_cols = [4, 5, 7, 6, 8, 9, 11]
     
     # Calculating the groupwise statistics
-    group_stats = [clf_metrics(targets[idx],
-                               guesses[idx],
-                               mcnemar=mcnemar) 
-                   for idx in group_idx]
+    counts = np.asarray(counts, dtype=np.float64)
+    group_n = np.sum(counts, axis=-1)
+    n = np.sum(group_n, axis=-1, keepdims=True)
+    present = group_n > 0
+    tn, fp, fn, tp = [counts[..., i].ravel() for i in range(4)]
+    group_stats = metric_array(tp, fp, tn, fn, mcnemar=mcnemar)
+    group_stats = group_stats.reshape(group_n.shape + (-1,))
     
     # Casting the basic counts as proportions
-    for i, df in enumerate(group_stats):
-        df[count_cols] /= group_counts[i]
-        df[prev_cols] /= group_counts[i]
-    
-    group_stats = pd.concat(group_stats, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        group_n = group_n[..., None]
+        group_stats[..., count_cols] /= group_n
+        group_stats[..., prev_cols] /= group_n
     
     # Calculating the weights
     if weighted:
-        w = np.array(group_counts / n)
+        w = group_n[..., 0] / n
     else:
-        w = np.repeat(1 / n_groups, n_groups)
+        w = present / np.sum(present, axis=-1, keepdims=True)
     
-    # Calculating the mean values
-    averages = np.average(group_stats, axis=0, weights=w)
-    avg_stats = pd.DataFrame(averages).transpose()
-    avg_stats.columns = group_stats.columns.values
+    # Calculating the mean values, zeroing out the empty groups so their
+    # NaNs don't carry over
+    vals = np.where(present[..., None], group_stats, 0)
+    avg_stats = np.sum(vals * w[..., None], axis=-2)
+    avg_stats /= np.sum(w, axis=-1, keepdims=True)
     
-    # Converting the count metrics back to integers
-    avg_stats[count_cols] *= n
-    avg_stats[count_cols] = avg_stats[count_cols].astype(int)
-    avg_stats[prev_cols] *= n
-    avg_stats.rel_prev_diff = avg_stats.prev_diff / avg_stats.true_prev
+    # Converting the count metrics back to counts
+    avg_stats[..., count_cols] = np.trunc(avg_stats[..., count_cols] * n)
+    avg_stats[..., prev_cols] *= n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_stats[..., 15] = avg_stats[..., 14] / avg_stats[..., 12]
     
     # Rounding off the floats
-    float_cols = ['sens', 'spec', 'npv', 
-                  'ppv', 'j', 'f1', 'brier']
-    avg_stats[float_cols] = avg_stats[float_cols].round(round)
-    avg_stats.rel_prev_diff = avg_stats.rel_prev_diff.round(round)
+    avg_stats[..., float_cols] = np.round(avg_stats[..., float_cols], round)
+    avg_stats[..., 15] = np.round(avg_stats[..., 15], round)
     
     # Getting the mean of the p-values with either Fisher's method
     # or the harmonic mean method
     if mcnemar:
-        avg_stats.mcnemar = average_pvals(group_stats.mcnemar,
-                                          w=w,
-                                          method=p_method)
+        avg_stats[..., 16] = average_pvals(group_stats[..., 16],
+                                           w=w,
+                                           method=p_method)
     
     return avg_stats
 
 
+# Column names for the output of clf_metrics() and its batched versions
+METRIC_COLS = ['tp', 'fp', 'tn', 'fn', 
+               'sens', 'spec', 'ppv', 'npv', 
+               'j', 'f1', 'mcc', 'brier',
+               'true_prev', 'pred_prev', 
+               'prev_diff', 'rel_prev_diff']
+
+
+def clf_counts(targets, guesses, weights=None):
+    '''Gets the 2x2 table for a set of class predictions with a single
+    bincount over the cells.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      guesses: the predicted labels (arr of {0, 1})
+      weights: the number of records each row stands for (arr of ints, or 
+        None for 1 each)
+    
+    Returns
+      the counts in the order tn, fp, fn, tp (arr of 4 ints)
+    '''
+    cells = 2 * np.asarray(targets, dtype=np.int64)
+    cells += np.asarray(guesses, dtype=np.int64)
+    counts = np.bincount(cells, weights=weights, minlength=4)
+    return counts.astype(np.int64)
+
+
+def metric_array(tp, fp, tn, fn, 
+                 round=4, 
+                 mcnemar=False,
+                 cc=True):
+    '''Low-level version of count_metrics() that skips the data frame and
+    returns the metrics as a plain array, for the inner loops.
+    
+    Parameters
+      tp: true positive counts (int or 1-d arr of ints)
+      fp: false positive counts (int or 1-d arr of ints)
+      tn: true negative counts (int or 1-d arr of ints)
+      fn: false negative counts (int or 1-d arr of ints)
+      round: number of significant digits to report
+      mcnemar: whether to add p-values from McNemar's test (bool)
+      cc: whether to use a continuity correction for McNemar's test (bool)
+    
+    Returns
+      an array of shape (n_tables, n_metrics), with columns in the order of
+        METRIC_COLS plus 'mcnemar' (when requested)
+    '''
+    n_cols = len(METRIC_COLS) + int(mcnemar)
+    cells = np.array([tp, fp, tn, fn], dtype=np.float64).reshape(4, -1)
+    out = np.empty((cells.shape[1], n_cols))
+    out[:, :4] = cells.T
+    tp, fp, tn, fn = cells
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculating basic measures of diagnostic accuracy, doing the 
+        # divisions and rounding for sens, spec, ppv, and npv in one go
+        nums = np.array([tp, tn, tp, tn])
+        denoms = np.array([tp + fn, tn + fp, tp + fp, tn + fn])
+        out[:, 4:8] = np.round(nums / denoms, round).T
+        sens, spec, ppv = out[:, 4], out[:, 5], out[:, 6]
+        out[:, 8] = sens + spec - 1
+        out[:, 9] = np.round(2 * (sens * ppv) / (sens + ppv), round)
+        mcc_num = ((tp * tn) - (fp * fn))
+        mcc_denom = np.sqrt(((tp+fp)*(tp+fn)*(tn+fp)*(tn+fn)))
+        out[:, 10] = mcc_num / mcc_denom
+        out[:, 11] = np.round((fp + fn) / (tp + fp + tn + fn), round)
+        
+        # Calculating some additional measures based on positive calls
+        out[:, 12] = tp + fn
+        out[:, 13] = tp + fp
+        out[:, 14] = out[:, 13] - out[:, 12]
+        out[:, 15] = np.round(out[:, 14] / out[:, 12], round)
+        
+        # Optionally running McNemar's test on the discordant cells
+        if mcnemar:
+            if cc:
+                stat = (np.abs(fp - fn) - 1)**2 / (fp + fn)
+            else:
+                stat = (fp - fn)**2 / (fp + fn)
+            out[:, 16] = 1 - chi2.cdf(stat, 1)
+    
+    return out
+
+
+def count_metrics(tp, fp, tn, fn, 
+                  round=4, 
+                  mcnemar=False,
+                  cc=True):
+    '''Calculates the metrics from clf_metrics() for one or more 2x2 tables
+    at once, working straight from the cell counts.
+    
+    Parameters
+      tp: true positive counts (int or 1-d arr of ints)
+      fp: false positive counts (int or 1-d arr of ints)
+      tn: true negative counts (int or 1-d arr of ints)
+      fn: false negative counts (int or 1-d arr of ints)
+      round: number of significant digits to report
+      mcnemar: whether to add p-values from McNemar's test (bool)
+      cc: whether to use a continuity correction for McNemar's test (bool)
+    
+    Returns
+      a data frame with one row per table and the columns of clf_metrics()
+    '''
+    outmat = metric_array(tp, fp, tn, fn, round, mcnemar, cc)
+    columns = METRIC_COLS + ['mcnemar'] if mcnemar else METRIC_COLS
+    return pd.DataFrame(outmat, columns=columns)
+
+
+def batch_clf_metrics(targets, 
+                      guesses, 
+                      n=None,
+                      round=4,
+                      mcnemar=False,
+                      planes=None):
+    '''Batched version of clf_metrics() that scores many sets of predicted 
+    labels against the same true labels in one call.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1}, or a packed bitset if n is set)
+      guesses: the predicted labels, one row per rule (2-d arr of {0, 1} of 
+        shape (n_rules, n_records), or a stack of packed bitsets if n is set)
+      n: the number of records, if the labels are packed (int)
+      round: number of significant digits to report
+      mcnemar: whether to add p-values from McNemar's test (bool)
+      planes: weight_planes() for the rows, if they're weighted (with n 
+        set to the total weight)
+    
+    Returns
+      a data frame with one row per rule and the columns of clf_metrics()
+    '''
+    # Packing the labels so the counts come from popcounts
+    if n is None:
+        targets = np.array(targets).ravel()
+        n = targets.shape[0]
+        targets = pack_cols(targets)[0]
+        guesses = np.packbits(np.array(guesses, dtype=bool), axis=-1)
+    
+    guesses = guesses.reshape(-1, targets.shape[0])
+    tp, fp, tn, fn = packed_confusion(targets, guesses, n, planes)
+    return count_metrics(tp, fp, tn, fn, 
+                         round=round, 
+                         mcnemar=mcnemar)
+
+
+def cell_jackknife(targets, guesses, round=4, mcnemar=False):
+    '''Closed-form jackknife for clf_metrics(). Leaving out one record only
+    takes 1 away from the cell of the 2x2 table that record falls in, so 
+    there are at most 4 distinct leave-one-out replicates.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      guesses: the predicted labels (arr of {0, 1})
+      round: number of significant digits to report
+      mcnemar: whether to add p-values from McNemar's test (bool)
+    
+    Returns
+      cell_stats: the count_metrics() for leaving out a record from each 
+        cell, in the order tn, fp, fn, tp (pd.DataFrame with 4 rows)
+      counts: the number of records in each cell, in the same order (arr)
+      cells: the cell each record falls in, as a row number for 
+        cell_stats (arr of ints)
+    '''
+    cells = 2 * np.array(targets, dtype=np.int64) 
+    cells += np.array(guesses, dtype=np.int64)
+    counts = np.bincount(cells, minlength=4)
+    
+    # Taking 1 away from each cell in turn
+    reps = counts - np.eye(4, dtype=np.int64)
+    cell_stats = count_metrics(tp=reps[:, 3],
+                               fp=reps[:, 1],
+                               tn=reps[:, 0],
+                               fn=reps[:, 2],
+                               round=round,
+                               mcnemar=mcnemar)
+    
+    return cell_stats, counts, cells
+
+
 def average_pvals(p_vals, 
                   w=None, 
                   method='harmonic',
@@ -284,29 +477,48 @@ def average_pvals(p_vals,
     '''Averages p-values using either the harmonic mean or Fisher's method.
     
     Parameters
-      p_vals: the p-values (arr of floats in [0, 1])
-      w: the weights for averaging
+      p_vals: the p-values (arr of floats in [0, 1]), or an array with one
+        set of p-values to average along each of its last axis
+      w: the weights for averaging; p-values with a weight of 0 are left 
+        out (with either method)
       method: either 'harmonic' (default) or 'fisher' (str)
       smooth: whether to fix pvals of 0.0 (bool)
       smooth_val: the amount to use for smoothing (float)
     
     Returns
-      the average p-value (single float in [0, 1])
+      the average p-value (single float in [0, 1], or an array of them)
     '''
     if smooth:
-        p = p_vals + smooth_val
+        p = np.asarray(p_vals) + smooth_val
     else:
-        p = deepcopy(p_vals)
-    if method == 'harmonic':
-        if w is None:
-            w = np.repeat(1 / len(p), len(p))
-        p_avg = 1 / np.sum(w / p)
-    elif method == 'fisher':
-        stat = -2 * np.sum(np.log(p))
-        p_avg = 1 - chi2(df=1).cdf(stat)
+        p = deepcopy(np.asarray(p_vals))
+    if w is None:
+        w = np.full(p.shape, 1 / p.shape[-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == 'harmonic':
+            p_avg = 1 / np.sum(np.where(w > 0, w / p, 0), axis=-1)
+        elif method == 'fisher':
+            stat = -2 * np.sum(np.where(w > 0, np.log(p), 0), axis=-1)
+            p_avg = 1 - chi2.cdf(stat, 1)
     return p_avg
 
 
+def boot_seeds(seed=None, n=1):
+    '''Spawns independent random streams for a set of bootstrap samples. 
+    Each sample gets its own child of np.random.SeedSequence(seed), so the 
+    draws for a sample are the same no matter how many workers the samples
+    are spread across, or in what order they run.
+    
+    Parameters
+      seed: the root seed for the streams (int, or None for fresh entropy)
+      n: the number of streams to spawn (int)
+    
+    Returns
+      a list of n np.random.SeedSequence objects
+    '''
+    return np.random.SeedSequence(seed).spawn(n)
+
+
 def boot_sample(df,
                 by=None,
                 size=None,
@@ -318,17 +530,16 @@ def boot_sample(df,
       df: the data frame holding the records (2-d array or pd.DataFrame)
       by: an array of group IDs for sampling by group instead of row (arr)
       size: the size of bootstrap samples to take, if not nrow(df) (int)
-      seed: seed to use for generating the random sample (int)
+      seed: seed for the sample's random stream (int, or a SeedSequence 
+        from boot_seeds()); the global np.random state is left alone
       return_df: whether to return row indices (False) or the df (True)
     
     Returns
       1a. An array of bootstrap-sampled row numbers, if return_df is False; OR
       1b. A boostrap sample of the original df, if return_df is True
     '''
-    # Setting the random states for the samples
-    if seed is None:
-        seed = np.random.randint(1, 1e6, 1)[0]
-    np.random.seed(seed)
+    # Setting up the random stream for the sample
+    rng = np.random.default_rng(seed)
     
     # Getting the sample size
     if size is None:
@@ -336,21 +547,13 @@ def boot_sample(df,
     
     # Sampling across groups, if group is unspecified
     if by is None:
-        np.random.seed(seed)
-        idx = range(size)
-        boot = np.random.choice(idx,
-                                size=size,
-                                replace=True)
+        boot = rng.integers(0, size, size)
     
     # Sampling by group, if group has been specified
     else:
-        levels = np.unique(by)
-        level_idx = [np.where(by == level)[0]
-                     for level in levels]
-        boot = np.random.choice(level_idx,
-                                size=len(levels),
-                                replace=True) 
-        boot = np.concatenate(boot).ravel()
+        level_idx = group_rows(by)
+        picks = rng.integers(0, len(level_idx), len(level_idx))
+        boot = np.concatenate([level_idx[j] for j in picks]).ravel()
     
     if not return_df:
         return boot
@@ -358,6 +561,529 @@ def boot_sample(df,
         return df.iloc[boot, :]
     
 
+def group_rows(by):
+    '''Gets the row numbers for each group in one sort instead of one 
+    np.where() per group.
+    
+    Parameters
+      by: the group ID for each record (arr)
+    
+    Returns
+      a list of arrays of row numbers, with the groups in the order of
+        np.unique(by) and the rows in ascending order
+    '''
+    codes = np.unique(by, return_inverse=True)[1].ravel()
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes))[:-1]
+    return np.split(order, bounds)
+
+
+def boot_counts(targets, 
+                guesses, 
+                seeds, 
+                by=None,
+                batch_size=None,
+                average_by=None):
+    '''Gets the 2x2 table counts for a whole set of bootstrap samples at
+    once, without building a data frame (or, when sampling by row, an index
+    array) per sample. Each sample is drawn exactly the way boot_sample() 
+    draws it with the same seed.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      guesses: the predicted labels (arr of {0, 1}), or a 2-d array with 
+        one column per rule to score all the rules on the same samples
+      seeds: the seeds for the bootstrap samples (e.g., from boot_seeds())
+      by: an array of group IDs for sampling by group instead of row (arr)
+      batch_size: number of samples to draw at a time
+      average_by: an array of group IDs to keep separate counts for, e.g.,
+        for macro averaging (arr)
+    
+    Returns
+      an array of shape (n_samples, 4) with the counts in the order tn, fp,
+        fn, tp, or of shape (n_samples, n_rules, 4) if guesses is 2-d; with
+        average_by, the counts for each of its groups (in the order of 
+        np.unique(average_by)) get their own axis before the last one
+    '''
+    guesses = np.array(guesses, dtype=np.int64)
+    one_rule = len(guesses.shape) == 1
+    cells = 2 * np.array(targets, dtype=np.int64).reshape(-1, 1)
+    cells = cells + guesses.reshape(cells.shape[0], -1)
+    n, n_rules = cells.shape
+    n_boot = len(seeds)
+    
+    # Giving each averaging group its own 4 cells
+    n_avg = 1
+    if average_by is not None:
+        avg_codes = np.unique(average_by, return_inverse=True)[1].ravel()
+        n_avg = np.max(avg_codes) + 1
+        cells = cells + 4 * avg_codes.reshape(-1, 1)
+    width = 4 * n_avg
+    counts = np.zeros((n_boot, n_rules, width), dtype=np.int64)
+    
+    # Sampling across rows, drawing the indices for a batch of samples as a
+    # matrix and counting each row's cells with a single bincount
+    if by is None:
+        if batch_size is None:
+            batch_size = np.maximum(1, 2**24 // (n_rules * (n + width)))
+        offsets = width * np.arange(n_rules)
+        for start in range(0, n_boot, batch_size):
+            batch = seeds[start:start + batch_size]
+            idx = np.array([np.random.default_rng(s).integers(0, n, n)
+                            for s in batch])
+            batch_offsets = width * n_rules * np.arange(len(batch))
+            batch_offsets = batch_offsets.reshape(-1, 1, 1) + offsets
+            batch_counts = np.bincount((cells[idx] + batch_offsets).ravel(),
+                                       minlength=width * n_rules * len(batch))
+            counts[start:start + len(batch)] = batch_counts.reshape(-1, 
+                                                                    n_rules, 
+                                                                    width)
+    
+    # Sampling by group, using a per-group 2x2 count table so each sample
+    # is just a sum of the count rows for the groups it draws
+    else:
+        group_counts = group_cell_counts(cells, by, width)
+        n_levels = group_counts.shape[0]
+        if batch_size is None:
+            batch_size = np.maximum(1, 2**24 // n_levels)
+        for start in range(0, n_boot, batch_size):
+            batch = seeds[start:start + batch_size]
+            picks = np.array([np.random.default_rng(s).integers(0, 
+                                                                n_levels, 
+                                                                n_levels)
+                              for s in batch])
+            
+            # Counting how many times each group was drawn in each sample
+            offsets = n_levels * np.arange(len(batch)).reshape(-1, 1)
+            weights = np.bincount((picks + offsets).ravel(),
+                                  minlength=n_levels * len(batch))
+            weights = weights.reshape(-1, n_levels)
+            batch_counts = weights.dot(group_counts)
+            counts[start:start + len(batch)] = batch_counts.reshape(-1,
+                                                                    n_rules,
+                                                                    width)
+    
+    if average_by is not None:
+        counts = counts.reshape(n_boot, n_rules, n_avg, 4)
+    if one_rule:
+        return counts[:, 0]
+    return counts
+
+
+def group_cell_counts(cells, by, width=4):
+    '''Tallies the cells of the 2x2 table for each group.
+    
+    Parameters
+      cells: the cell for each record, as 2 * target + guess (arr of ints),
+        or a 2-d array with one column per rule
+      by: the group ID for each record (arr)
+      width: the number of possible cells per rule (int; more than 4 when 
+        the cells are also split by another set of groups)
+    
+    Returns
+      an array of shape (n_groups, 4) with the counts in the order tn, fp,
+        fn, tp, with the groups in the order of np.unique(by); for 2-d 
+        cells, the rules' counts are side by side, for a shape of 
+        (n_groups, 4 * n_rules)
+    '''
+    codes = np.unique(by, return_inverse=True)[1].ravel()
+    n_levels = np.max(codes) + 1
+    n_rules = 1 if len(cells.shape) == 1 else cells.shape[1]
+    cells = cells.reshape(codes.shape[0], n_rules)
+    offsets = width * (n_rules * codes.reshape(-1, 1) + np.arange(n_rules))
+    counts = np.bincount((offsets + cells).ravel(), 
+                         minlength=width * n_rules * n_levels)
+    return counts.reshape(-1, width * n_rules)
+
+
+def boot_metrics(targets, 
+                 guesses, 
+                 seeds, 
+                 by=None,
+                 round=4,
+                 average_by=None,
+                 weighted=True,
+                 mcnemar=False):
+    '''Array-native bootstrap of clf_metrics(); runs metric_array() (or, 
+    with macro averaging, macro_metrics()) on the boot_counts() for a set 
+    of seeds.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      guesses: the predicted labels (arr of {0, 1})
+      seeds: the seeds for the bootstrap samples (e.g., from boot_seeds())
+      by: an array of group IDs for sampling by group instead of row (arr)
+      round: number of significant digits to report
+      average_by: the variable to use for macro averaging (1-d array)
+      weighted: whether to weight macro averaging (bool)
+      mcnemar: whether to add p-values from McNemar's test (bool; always
+        added with macro averaging, like macro_clf_metrics())
+    
+    Returns
+      an array of shape (n_samples, n_metrics), with the metrics in the 
+        order of METRIC_COLS, plus 'mcnemar' when it's added
+    '''
+    counts = boot_counts(targets, guesses, seeds, 
+                         by=by, 
+                         average_by=average_by)
+    if average_by is not None:
+        return macro_metrics(counts, weighted=weighted, round=round)
+    return metric_array(tp=counts[:, 3],
+                        fp=counts[:, 1],
+                        tn=counts[:, 0],
+                        fn=counts[:, 2],
+                        round=round,
+                        mcnemar=mcnemar)
+
+
+def stack_percentiles(scores, 
+                      q, 
+                      interpolation='nearest', 
+                      presorted=False):
+    '''Vectorized np.nanpercentile() over the samples in a stack of 
+    bootstrap scores, allowing a different percentile for every rule and 
+    metric. Gives the same values as calling np.nanpercentile() on each 
+    column by itself.
+    
+    Parameters
+      scores: the metrics for the bootstrap samples, with shape (n_rules,
+        n_samples, n_metrics)
+      q: the percentiles to get (float, or arr that broadcasts to shape
+        (n_rules, n_metrics), 0-100)
+      interpolation: interpolation method; options are 'linear', 'lower',
+        'higher', 'midpoint', and 'nearest'
+      presorted: whether scores is already sorted along the samples axis
+    
+    Returns
+      an array of shape (n_rules, n_metrics) with the percentiles
+    '''
+    if not presorted:
+        scores = np.sort(scores, axis=1)
+    n_rules, n_samples, n_metrics = scores.shape
+    q = np.true_divide(np.broadcast_to(q, (n_rules, n_metrics)), 100)
+    
+    # Finding where each percentile falls among the non-NaN values, which
+    # the sort puts first
+    n = np.sum(~np.isnan(scores), axis=1)
+    last = np.maximum(n - 1, 0)
+    virtual = (n - 1) * q
+    
+    def take(idx):
+        idx = np.clip(idx, 0, last).astype(np.intp)
+        return np.take_along_axis(scores, idx[:, None, :], axis=1)[:, 0]
+    
+    if interpolation == 'nearest':
+        out = take(np.around(virtual))
+    elif interpolation == 'lower':
+        out = take(np.floor(virtual))
+    elif interpolation == 'higher':
+        out = take(np.ceil(virtual))
+    else:
+        # Interpolating between the neighboring values the way NumPy does
+        prev = np.floor(virtual)
+        gamma = virtual - prev
+        if interpolation == 'midpoint':
+            gamma = np.where(virtual % 1 == 0, 0.0, 0.5)
+        a = take(prev)
+        b = take(prev + 1)
+        diff_b_a = b - a
+        out = np.where(gamma >= 0.5, 
+                       b - diff_b_a * (1 - gamma),
+                       a + diff_b_a * gamma)
+    
+    out[n == 0] = np.nan
+    return out
+
+
+def boot_mcse(scores, q, presorted=False):
+    '''Estimates the Monte Carlo standard error of bootstrap percentiles 
+    from the spread of the order statistics one binomial standard deviation
+    on either side of each one.
+    
+    Parameters
+      scores: the metrics for the bootstrap samples, with shape (n_rules,
+        n_samples, n_metrics), or (n_samples, n_metrics) for one rule
+      q: the percentiles to check (float, or arr that broadcasts to shape
+        (n_rules, n_metrics), 0-100)
+      presorted: whether scores is already sorted along the samples axis
+    
+    Returns
+      an array with the standard error for each rule and metric
+    '''
+    scores = np.array(scores, dtype=np.float64)
+    one_rule = len(scores.shape) == 2
+    if one_rule:
+        scores = scores[None]
+    if not presorted:
+        scores = np.sort(scores, axis=1)
+    
+    q = np.true_divide(np.broadcast_to(q, (scores.shape[0], 
+                                           scores.shape[2])), 100)
+    n = np.maximum(np.sum(~np.isnan(scores), axis=1), 1)
+    sd = np.sqrt(q * (1 - q) / n)
+    lo = np.clip(q - sd, 0, 1) * 100
+    hi = np.clip(q + sd, 0, 1) * 100
+    se = (stack_percentiles(scores, hi, 'linear', presorted=True) - 
+          stack_percentiles(scores, lo, 'linear', presorted=True)) / 2
+    
+    if one_rule:
+        return se[0]
+    return se
+
+
+def jack_acc(diffs):
+    '''Gets the BCa acceleration factor from jackknife replicates. 
+    
+    Parameters
+      diffs: the jackknife mean minus each replicate, with shape (n_rules,
+        n_replicates, n_metrics); NaNs are skipped
+    
+    Returns
+      an array of shape (n_rules, n_metrics) with the acceleration factors
+    '''
+    diffs = np.array(diffs, dtype=np.float64)
+    numer = np.nansum(np.power(diffs, 3), axis=1)
+    denom = 6 * np.power(np.nansum(np.power(diffs, 2), axis=1), 3/2)
+    
+    # Getting rid of 0s in the denominator
+    denom[denom == 0] += 1e-6
+    
+    return numer / denom
+
+
+def boot_intervals(stat, 
+                   scores, 
+                   a=0.05, 
+                   method='bca', 
+                   interpolation='nearest', 
+                   acc=None):
+    '''Calculates bootstrap confidence intervals for a stack of rules at 
+    once; used by multi.boot_cis() and diff_boot_cis().
+    
+    Parameters
+      stat: the point estimates, with shape (n_rules, n_metrics)
+      scores: the metrics for the bootstrap samples, with shape (n_rules,
+        n_samples, n_metrics)
+      a: significance level for the intervals (float in [0, 1])
+      method: interval method; options are 'diff', 'pct', and 'bca'
+      interpolation: interpolation method for np.quantile
+      acc: the acceleration factors from jack_acc(), for 'bca'
+    
+    Returns
+      bounds: the lower and upper bounds, with shape (n_rules, n_metrics, 2)
+      mc_se: the Monte Carlo standard errors of the bounds, with the same
+        shape
+      levels: the percentiles of the scores the bounds came from, with the
+        same shape
+    '''
+    # Quick check for a valid estimation method
+    methods = ['pct', 'diff', 'bca']
+    assert method in methods, 'Method must be pct, diff, or bca.'
+    
+    stat = np.array(stat, dtype=np.float64)
+    scores = np.array(scores, dtype=np.float64)
+    n = scores.shape[1]
+    
+    # Setting the quantiles to retrieve
+    lower = (a / 2) * 100
+    upper = 100 - lower
+    lower_q = np.full(stat.shape, lower)
+    upper_q = np.full(stat.shape, upper)
+    
+    # Method #2 takes the percentiles of the difference between the 
+    # observed statistics and the bootstrapped statistics
+    if method == 'diff':
+        scores = stat[:, None, :] - scores
+    
+    # And method #3 adjusts the percentiles for bias and acceleration
+    elif method == 'bca':
+        # Calculating the bias-correction factor
+        n_less = np.sum(scores < stat[:, None, :], axis=1)
+        p_less = n_less / n
+        z0 = norm.ppf(p_less)
+        
+        # Fixing infs in z0
+        z0[np.isinf(z0)] = 0.0
+        
+        # Calculating the bounds for the confidence intervals
+        zl = norm.ppf(a / 2)
+        zu = norm.ppf(1 - (a/2))
+        lterm = (z0 + zl) / (1 - acc*(z0 + zl))
+        uterm = (z0 + zu) / (1 - acc*(z0 + zu))
+        lower_q = norm.cdf(z0 + lterm) * 100
+        upper_q = norm.cdf(z0 + uterm) * 100
+    
+    # Getting the percentiles and their errors from a single sort
+    scores = np.sort(scores, axis=1)
+    levels = np.stack([lower_q, upper_q], axis=-1)
+    bounds = np.stack([stack_percentiles(scores, lower_q, interpolation, 
+                                         presorted=True),
+                       stack_percentiles(scores, upper_q, interpolation,
+                                         presorted=True)], 
+                      axis=-1)
+    mc_se = np.stack([boot_mcse(scores, lower_q, presorted=True),
+                      boot_mcse(scores, upper_q, presorted=True)], 
+                     axis=-1)
+    if method == 'diff':
+        bounds = stat[:, :, None] + bounds
+    
+    return bounds, mc_se, levels
+
+
+def save_boot_cis(dir, cis, rules):
+    '''Writes a list of multi.boot_cis objects to a directory of .npy 
+    files that boot_store() can memory-map, in place of pickling the 
+    objects and their data frames. The jackknife scores are kept as their
+    distinct rows and how many times each one occurs.
+    
+    Parameters
+      dir: the directory to write the files to (str)
+      cis: the boot_cis objects (list)
+      rules: the name of the rule for each object (list of str)
+    '''
+    os.makedirs(dir, exist_ok=True)
+    
+    # Padding the scores with NaNs when the rules used different numbers 
+    # of bootstrap samples
+    n_boot = np.array([ci.scores.shape[0] for ci in cis])
+    scores = np.full((len(cis), np.max(n_boot), cis[0].scores.shape[1]),
+                     np.nan)
+    for r, ci in enumerate(cis):
+        scores[r, :n_boot[r]] = ci.scores.values
+    
+    arrays = {'rules': np.array(rules, dtype=str),
+              'metrics': np.array(cis[0].cis.index.values, dtype=str),
+              'cis': np.stack([ci.cis.values for ci in cis]),
+              'mc_se': np.stack([ci.mc_se.values for ci in cis]),
+              'n_boot': n_boot,
+              'scores': scores}
+    
+    # Collapsing each rule's jackknife scores to their distinct rows,
+    # comparing the rows byte-wise so that rows with NaNs still match
+    if hasattr(cis[0], 'jack'):
+        jack_rows, jack_counts, jack_sizes = [], [], []
+        for ci in cis:
+            vals = np.ascontiguousarray(ci.jack[0].values, dtype=np.float64)
+            keys = vals.view(np.dtype((np.void, 8 * vals.shape[1])))
+            first, counts = np.unique(keys.ravel(), 
+                                      return_index=True,
+                                      return_counts=True)[1:]
+            jack_rows.append(vals[first])
+            jack_counts.append(counts)
+            jack_sizes.append(len(first))
+        arrays['jack_rows'] = np.concatenate(jack_rows)
+        arrays['jack_counts'] = np.concatenate(jack_counts)
+        arrays['jack_bounds'] = np.cumsum([0] + jack_sizes)
+        arrays['jack_means'] = np.stack([ci.jack[1].values for ci in cis])
+    
+    for name, arr in arrays.items():
+        path = os.path.join(dir, name + '.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, arr)
+        os.replace(path + '.tmp', path)
+    
+    # Clearing out the jackknife from an earlier save that had one
+    if not hasattr(cis[0], 'jack'):
+        for name in ['jack_rows', 'jack_counts', 'jack_bounds', 'jack_means']:
+            path = os.path.join(dir, name + '.npy')
+            if os.path.exists(path):
+                os.remove(path)
+    
+    return
+
+
+class stored_cis:
+    '''Stand-in for a multi.boot_cis object that was read back from a
+    boot_store. The scores are a view of the memory-mapped file, so they are
+    only read from disk when they're used.
+    
+    Attributes:
+      cis: confidence intervals
+      scores: observed metrics for each bootstrap sample
+      n_boot: the number of bootstrap samples used
+      mc_se: Monte Carlo standard errors for the lower and upper bounds
+      jack: the jackknife scores and means, if the CIs were BCa
+    '''
+    
+    def __init__(self, cis, scores, mc_se, jack=None):
+        self.cis = cis
+        self.scores = scores
+        self.n_boot = scores.shape[0]
+        self.mc_se = mc_se
+        if jack is not None:
+            self.jack = jack
+
+
+class boot_store:
+    '''Read-only access to the boot_cis objects written by save_boot_cis(),
+    keyed by rule name. Only the small arrays are loaded up front; the 
+    bootstrap scores are memory-mapped and read one rule at a time.
+    
+    Attributes:
+      dir: the directory holding the files
+      rules: the rule names, in the order they were saved
+      metrics: the names of the metrics
+    '''
+    
+    def __init__(self, dir):
+        self.dir = dir
+        self.rules = list(self._load('rules'))
+        self.metrics = list(self._load('metrics'))
+        self._cis = self._load('cis')
+        self._mc_se = self._load('mc_se')
+        self._n_boot = self._load('n_boot')
+        self._scores = self._load('scores', mmap_mode='r')
+        self._jack = os.path.exists(os.path.join(dir, 'jack_rows.npy'))
+        if self._jack:
+            self._jack_rows = self._load('jack_rows', mmap_mode='r')
+            self._jack_counts = self._load('jack_counts')
+            self._jack_bounds = self._load('jack_bounds')
+            self._jack_means = self._load('jack_means')
+        return
+    
+    def _load(self, name, mmap_mode=None):
+        return np.load(os.path.join(self.dir, name + '.npy'), 
+                       mmap_mode=mmap_mode)
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    def __getitem__(self, rule):
+        '''Gets the results for a rule by name (or by position).'''
+        if not isinstance(rule, (int, np.integer)):
+            rule = self.rules.index(rule)
+        
+        # Rebuilding the data frames the way boot_cis makes them
+        cis = pd.DataFrame(self._cis[rule],
+                           columns=['stat', 'lower', 'upper'],
+                           index=self.metrics)
+        mc_se = pd.DataFrame(self._mc_se[rule],
+                             columns=['lower', 'upper'],
+                             index=self.metrics)
+        scores = self._scores[rule, :self._n_boot[rule]]
+        scores = pd.DataFrame(scores,
+                              columns=self.metrics,
+                              index=np.zeros(scores.shape[0], 
+                                             dtype=np.int64))
+        jack = None
+        
+        # Expanding the jackknife rows back to one per record
+        if self._jack:
+            start, end = self._jack_bounds[rule:rule + 2]
+            rows = np.repeat(self._jack_rows[start:end],
+                             self._jack_counts[start:end],
+                             axis=0)
+            jack_scores = pd.DataFrame(rows,
+                                       columns=self.metrics,
+                                       index=np.zeros(rows.shape[0],
+                                                      dtype=np.int64))
+            jack_means = pd.Series(self._jack_means[rule], 
+                                   index=self.metrics)
+            jack = (jack_scores, jack_means)
+        
+        return stored_cis(cis, scores, mc_se, jack)
+
+
 def diff_boot_cis(ref, 
                   comp, 
                   a=0.05,
@@ -368,8 +1094,8 @@ def diff_boot_cis(ref,
     performance metrics between two competing classifiers.
     
     Parameters
-      ref: the refernece multi.boot_cis object
-      comp: the comparison multi.boot_cis object
+      ref: the refernece multi.boot_cis object (or one from a boot_store)
+      comp: the comparison multi.boot_cis object (or one from a boot_store)
       a: significance level for the intervals (float in [0, 1])
       abs_diff: whether to take the absolute value of the difference (bool)
       method: interval method; options are 'diff', 'pct', and 'bca'
@@ -393,79 +1119,37 @@ def diff_boot_cis(ref,
     comp_stat = pd.Series(comp.cis.stat.drop('true_prev').values)
     comp_scores = comp.scores.drop('true_prev', axis=1)
     
+    # Pairing up the samples, using the first n from each if one of the 
+    # two stopped drawing them sooner
+    n = np.minimum(ref_scores.shape[0], comp_scores.shape[0])
+    ref_scores = ref_scores.iloc[:n]
+    comp_scores = comp_scores.iloc[:n]
+    
     # Optionally Reversing the order of comparison
-    diff_scores = comp_scores - ref_scores
+    diff_scores = comp_scores.values - ref_scores.values
     diff_stat = comp_stat - ref_stat
-        
-    # Setting the quantiles to retrieve
-    lower = (a / 2) * 100
-    upper = 100 - lower
     
-    # Calculating the percentiles 
-    if method == 'pct':
-        cis = np.nanpercentile(diff_scores,
-                               q=(lower, upper),
-                               interpolation=interpolation,
-                               axis=0)
-        cis = pd.DataFrame(cis.transpose())
-    
-    elif method == 'diff':
-        diffs = diff_stat.values.reshape(1, -1) - diff_scores
-        percents = np.nanpercentile(diffs,
-                                    q=(lower, upper),
-                                    interpolation=interpolation,
-                                    axis=0)
-        lower_bound = pd.Series(diff_stat + percents[0])
-        upper_bound = pd.Series(diff_stat + percents[1])
-        cis = pd.concat([lower_bound, upper_bound], axis=1)
+    # Estimating the acceleration factor from the jackknife for the two
+    # groups together; leaving out a record from one group only changes 
+    # that group's estimate, so the replicates for the difference are 
+    # those of the comp, followed by those of the ref with the sign flipped
+    acc = None
+    if method == 'bca':
+        comp_diffs = comp.jack[1] - comp.jack[0]
+        ref_diffs = ref.jack[1] - ref.jack[0]
+        diffs = np.concatenate([comp_diffs.drop('true_prev', axis=1).values,
+                                -ref_diffs.drop('true_prev', axis=1).values])
+        acc = jack_acc(diffs[None])
+    
+    # Calculating the CIs
+    bounds = boot_intervals(diff_stat.values[None],
+                            diff_scores[None],
+                            a=a,
+                            method=method,
+                            interpolation=interpolation,
+                            acc=acc)[0]
+    cis = pd.DataFrame(bounds[0], columns=['lower', 'upper'])
     
-    elif method == 'bca':
-        # Removing true prevalence from consideration to avoid NaNs
-        ref_j_means = ref.jack[1].drop('true_prev')
-        ref_j_scores = ref.jack[0].drop('true_prev', axis=1)
-        comp_j_means = comp.jack[1].drop('true_prev')
-        comp_j_scores = comp.jack[0].drop('true_prev', axis=1)
-        
-        # Calculating the bias-correction factor
-        n = ref.scores.shape[0]
-        stat_vals = diff_stat.transpose().values.ravel()
-        n_less = np.sum(diff_scores < stat_vals, axis=0)
-        p_less = n_less / n
-        z0 = norm.ppf(p_less)
-        
-        # Fixing infs in z0
-        z0[np.where(np.isinf(z0))[0]] = 0.0
-        
-        # Estiamating the acceleration factor
-        j_means = comp_j_means - ref_j_means
-        j_scores = comp_j_scores - ref_j_scores
-        diffs = j_means - j_scores
-        numer = np.sum(np.power(diffs, 3))
-        denom = 6 * np.power(np.sum(np.power(diffs, 2)), 3/2)
-        
-        # Getting rid of 0s in the denominator
-        zeros = np.where(denom == 0)[0]
-        for z in zeros:
-            denom[z] += 1e-6
-        
-        acc = numer / denom
-        
-        # Calculating the bounds for the confidence intervals
-        zl = norm.ppf(a / 2)
-        zu = norm.ppf(1 - (a/2))
-        lterm = (z0 + zl) / (1 - acc*(z0 + zl))
-        uterm = (z0 + zu) / (1 - acc*(z0 + zu))
-        lower_q = norm.cdf(z0 + lterm) * 100
-        upper_q = norm.cdf(z0 + uterm) * 100
-                                
-        # Returning the CIs based on the adjusted quantiles
-        cis = [np.nanpercentile(diff_scores.iloc[:, i], 
-                                q=(lower_q[i], upper_q[i]),
-                                interpolation=interpolation,
-                                axis=0) 
-               for i in range(len(lower_q))]
-        cis = pd.DataFrame(cis, columns=['lower', 'upper'])
-                
     cis = pd.concat([ref_stat, comp_stat, diff_stat, cis], 
                     axis=1)
     cis = cis.set_index(ref_scores.columns.values)
@@ -475,11 +1159,144 @@ def diff_boot_cis(ref,
     return cis
 
 
+def grid_tprs(fprs, tprs, grid):
+    '''Interpolates ROC curves onto a common grid of false positive rates.
+    Where a curve rises straight up at a grid point, the highest TPR there
+    is used.
+    
+    Parameters
+      fprs: the false positive rates for the curves, with one curve per row
+        and the rates in increasing order (2-d array)
+      tprs: the matching true positive rates (2-d array)
+      grid: the false positive rates to get the TPRs for (1-d array)
+    
+    Returns
+      an array of shape (n_curves, len(grid)) with the interpolated TPRs
+    '''
+    fprs = np.array(fprs, dtype=np.float64)
+    tprs = np.array(tprs, dtype=np.float64)
+    grid = np.array(grid, dtype=np.float64)
+    n_curves, n_points = fprs.shape
+    
+    # Finding the last point at or before each grid point in every curve
+    # with one search, by shifting each curve (and its copy of the grid) 
+    # past the end of the one before it
+    shift = 2 * np.arange(n_curves).reshape(-1, 1)
+    flat = np.searchsorted((np.nan_to_num(fprs) + shift).ravel(),
+                           (grid + shift).ravel(),
+                           side='right') - 1
+    prev = np.clip(flat.reshape(n_curves, -1) - shift // 2 * n_points,
+                   0,
+                   n_points - 1)
+    next = np.minimum(prev + 1, n_points - 1)
+    
+    # Interpolating between those points and the ones after them
+    x0 = np.take_along_axis(fprs, prev, axis=1)
+    x1 = np.take_along_axis(fprs, next, axis=1)
+    y0 = np.take_along_axis(tprs, prev, axis=1)
+    y1 = np.take_along_axis(tprs, next, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(x1 > x0, (y1 - y0) / (x1 - x0), 0.0)
+    out = y0 + slope * (grid - x0)
+    
+    # Curves that can't be drawn (e.g., with no positives) stay NaN
+    out[np.isnan(fprs).any(axis=1) | np.isnan(tprs).any(axis=1)] = np.nan
+    return out
+
+
+def boot_roc_curves(targets, 
+                    scores, 
+                    seeds, 
+                    by=None, 
+                    grid=None,
+                    batch_size=None):
+    '''Gets the ROC curves and AUCs for a set of bootstrap samples without
+    re-sorting the scores for each one. The scores are sorted once, and 
+    each sample's curve comes from cumulative sums of the number of times 
+    each record was drawn. Each sample is drawn exactly the way 
+    boot_sample() draws it with the same seed.
+    
+    Parameters
+      targets: the true labels (arr of {0, 1})
+      scores: predicted positive probabilities (arr of floats)
+      seeds: the seeds for the bootstrap samples (e.g., from boot_seeds())
+      by: an array of group IDs for sampling by group instead of row (arr)
+      grid: the false positive rates to put the curves on (1-d array, or
+        None for 0 to 1 in steps of .01)
+      batch_size: number of samples to draw at a time
+    
+    Returns
+      grid: the false positive rates for the curves
+      tprs: the true positive rates, with shape (n_samples, len(grid))
+      aucs: the area under each sample's full (not gridded) curve
+    '''
+    if grid is None:
+        grid = np.linspace(0, 1, 101)
+    grid = np.array(grid, dtype=np.float64)
+    targets = np.array(targets, dtype=np.float64)
+    scores = np.array(scores, dtype=np.float64)
+    n = targets.shape[0]
+    n_boot = len(seeds)
+    
+    # Sorting the scores from high to low and finding the last record at
+    # each distinct score, where the curve gets a point
+    order = np.argsort(-scores, kind='stable')
+    targets = targets[order]
+    ends = np.append(np.nonzero(np.diff(scores[order]))[0], n - 1)
+    
+    # Setting up the groups for sampling by group
+    if by is not None:
+        codes = np.unique(by, return_inverse=True)[1].ravel()[order]
+        size = np.max(codes) + 1
+    else:
+        size = n
+    
+    if batch_size is None:
+        batch_size = np.maximum(1, 2**23 // n)
+    
+    tprs = np.zeros((n_boot, len(grid)))
+    aucs = np.zeros(n_boot)
+    for start in range(0, n_boot, batch_size):
+        batch = seeds[start:start + batch_size]
+        picks = np.array([np.random.default_rng(s).integers(0, size, size)
+                          for s in batch])
+        
+        # Counting how many times each record was drawn in each sample
+        offsets = size * np.arange(len(batch)).reshape(-1, 1)
+        weights = np.bincount((picks + offsets).ravel(),
+                              minlength=size * len(batch))
+        weights = weights.reshape(-1, size)
+        if by is not None:
+            weights = weights[:, codes]
+        else:
+            weights = weights[:, order]
+        
+        # Getting the true and false positives at each distinct score
+        zeros = np.zeros((len(batch), 1))
+        tp = np.cumsum(weights * targets, axis=1)[:, ends]
+        fp = np.cumsum(weights * (1 - targets), axis=1)[:, ends]
+        tp = np.concatenate([zeros, tp], axis=1)
+        fp = np.concatenate([zeros, fp], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tpr = tp / tp[:, -1:]
+            fpr = fp / fp[:, -1:]
+        
+        # Getting the AUCs with the trapezoidal rule and the TPRs on the grid
+        stop = start + len(batch)
+        aucs[start:stop] = np.sum(np.diff(fpr, axis=1) * 
+                                  (tpr[:, 1:] + tpr[:, :-1]) / 2,
+                                  axis=1)
+        tprs[start:stop] = grid_tprs(fpr, tpr, grid)
+    
+    return grid, tprs, aucs
+
+
 def roc_cis(rocs, alpha=0.05, round=2):
     '''Calculates upper and lower bounds for a collection of ROC curves. 
     
     Parameters
-      rocs: the sklearn.metrics.roc_curve curves
+      rocs: the output of multi.boot_roc(), or a list of 
+        sklearn.metrics.roc_curve curves
       alpha: significance value for constructing the intervals
       round: number of significant digits to report
       
@@ -493,24 +1310,24 @@ def roc_cis(rocs, alpha=0.05, round=2):
     # Getting the quantiles to make CIs
     lq = (alpha / 2) * 100
     uq = (1 - (alpha / 2)) * 100
-    fprs = np.concatenate([roc[0] for roc in rocs], axis=0)
-    tprs = np.concatenate([roc[1] for roc in rocs], axis=0)
-    roc_arr = np.concatenate([fprs.reshape(-1, 1), 
-                              tprs.reshape(-1, 1)], 
-                             axis=1)
-    roc_df = pd.DataFrame(roc_arr, columns=['fpr', 'tpr'])
-    roc_df.fpr = roc_df.fpr.round(round)
-    unique_fprs = roc_df.fpr.unique()
-    fpr_idx = [np.where(roc_df.fpr == fpr)[0] for fpr in unique_fprs]
-    tpr_quants = [np.percentile(roc_df.tpr[idx], q=(lq, 50, uq)) 
-                  for idx in fpr_idx]
-    tpr_quants = np.vstack(tpr_quants)
-    quant_arr = np.concatenate([unique_fprs.reshape(-1, 1),
-                                tpr_quants],
+    
+    # Putting loose curves on a grid with steps at the rounding level
+    if isinstance(rocs, tuple):
+        grid, tprs = rocs[0], rocs[1]
+    else:
+        grid = np.linspace(0, 1, 10**round + 1)
+        tprs = np.concatenate([grid_tprs(roc[0].reshape(1, -1),
+                                         roc[1].reshape(1, -1),
+                                         grid)
+                               for roc in rocs])
+    
+    # Getting all the bands from one call
+    tpr_quants = np.nanpercentile(tprs, q=(lq, 50, uq), axis=0)
+    quant_arr = np.concatenate([np.round(grid, round).reshape(-1, 1),
+                                tpr_quants.transpose()],
                                axis=1)
     quant_df = pd.DataFrame(quant_arr, columns=['fpr', 'lower',
                                                 'med', 'upper'])
-    quant_df = quant_df.sort_values('fpr')
     return quant_df
 
 
@@ -586,7 +1403,8 @@ def sparsify(col,
 
 
 def rowsums(m, min=1):
-    '''Determines which rows of m have at least min 1s'''
+    '''Determines which rows of m have at least min 1s; m can be the
+    patterns from pattern_table() as well as the records themselves'''
     sums = np.sum(m, axis=1)
     return np.array(sums >= min, dtype=np.uint8)
 
@@ -630,7 +1448,8 @@ def combo_metrics(X, y,
                   cols, 
                   min=(1, 1),
                   mode='both',
-                  mcnemar=True):
+                  mcnemar=True,
+                  weights=None):
     '''Runs clf_metrics() on the combo_sum() of two sets of columns.
     
     Parameters
@@ -639,6 +1458,8 @@ def combo_metrics(X, y,
       cols: the 2 sets of column numbers for summing
       mode: whether to report metrics for 'both' or 'any' combo_sum
       mcnemar: whether to run McNemar's test
+      weights: the number of records each row stands for, e.g., from 
+        pattern_table() (arr of ints, or None for 1 each)
     
     Returns
       the output of clf_metrics() for the combined sets of columns
@@ -646,9 +1467,9 @@ def combo_metrics(X, y,
     ps = pairsum(X, cols, min=min)
     cs = combo_sum(ps)
     if mode == 'both':
-        return clf_metrics(y, cs[:, 0], mcnemar=mcnemar)
+        return clf_metrics(y, cs[:, 0], mcnemar=mcnemar, weights=weights)
     elif mode == 'any':
-        return clf_metrics(y, cs[:, 1], mcnemar=mcnemar)
+        return clf_metrics(y, cs[:, 1], mcnemar=mcnemar, weights=weights)
 
 
 def flatten(l):
@@ -662,3 +1483,732 @@ def unique_combo(c):
         return c
     else:
         return None
+
+
+def canonical_meta(cols, min, mode, c_max=None):
+    '''Puts a metacombo rule in canonical form, so rules that fire on 
+    exactly the same records get exactly the same form. Both modes are
+    symmetric, so the sides are sorted the same way as the column combos
+    (by size and then by column number). 'any' rules with two any-of-n 
+    sides and 'both' rules with two all-of-n sides only depend on the union
+    of their columns, so those are split the same way every time: as few
+    columns as possible on the first side, given at most c_max on each.
+    
+    Parameters
+      cols: the 2 sets of column numbers (tuple or list of lists of ints)
+      min: a tuple of minimum counts for the two sets of columns
+      mode: whether the rule is 'both' or 'any'
+      c_max: the largest number of columns allowed on a side (int)
+    
+    Returns
+      cols, min, mode: the canonical form of the rule
+    '''
+    sides = sorted([(sorted(c), m) for c, m in zip(cols, min)],
+                   key=lambda side: (len(side[0]), side[0]))
+    
+    # Checking whether the rule only depends on the union of the columns
+    if mode == 'any':
+        merge = sides[0][1] == 1 and sides[1][1] == 1
+    else:
+        merge = all([side[1] == len(side[0]) for side in sides])
+    
+    if not merge:
+        cols = (sides[0][0], sides[1][0])
+        min = (sides[0][1], sides[1][1])
+        return cols, min, mode
+    
+    # Splitting the union the same way every time
+    union = sorted(sides[0][0] + sides[1][0])
+    k = 1
+    if c_max is not None:
+        k = np.maximum(1, len(union) - c_max)
+    cols = (union[:k], union[k:])
+    if mode == 'any':
+        min = (1, 1)
+    else:
+        min = (len(cols[0]), len(cols[1]))
+    
+    return cols, min, mode
+
+
+def is_canonical(cols, min, mode, c_max=None):
+    '''Determines whether a metacombo rule is already in canonical form.'''
+    c_cols, c_min, _ = canonical_meta(cols, min, mode, c_max)
+    same_cols = list(c_cols[0]) == list(cols[0]) 
+    same_cols = same_cols and list(c_cols[1]) == list(cols[1])
+    return same_cols and tuple(c_min) == tuple(min)
+
+
+def meta_pairs(col_combos, min=(1, 1)):
+    '''Lazily generates the pairs of column combos for the metacombination
+    search, skipping pairs that share columns or that are too small for the 
+    minimum counts.
+    
+    Parameters
+      col_combos: the column combos to pair up (list of lists of ints)
+      min: a tuple of minimum counts for the two combos in each pair
+    
+    Yields
+      the pairs of combos, in the order of itertools.combinations()
+    '''
+    for pair in itertools.combinations(col_combos, 2):
+        if len(pair[0]) < min[0] or len(pair[1]) < min[1]:
+            continue
+        if set(pair[0]).isdisjoint(pair[1]):
+            yield pair
+
+
+def side_count_table(bits, y_bits, col_combos, max_m, planes=None):
+    '''Gets the true and false positive counts for the m-of-n rules from 
+    each column combo for every m up to max_m, with one pass over each 
+    combo's columns.
+    
+    Parameters
+      bits: the packed columns from pack_cols()
+      y_bits: the packed true labels
+      col_combos: the column combos (list of lists of ints)
+      max_m: the largest m to get counts for (int)
+      planes: weight_planes() for the rows, if they're weighted
+    
+    Returns
+      tp, fp: arrays of counts of shape (n_combos, max_m + 1), where column
+        m holds the counts for min=m (0 for combos smaller than m, and
+        for m = 0)
+    '''
+    n_combos = len(col_combos)
+    tp = np.zeros((n_combos, max_m + 1), dtype=np.int64)
+    fp = np.zeros((n_combos, max_m + 1), dtype=np.int64)
+    for i, cols in enumerate(col_combos):
+        at_least = packed_thresholds(bits, cols, np.minimum(len(cols), max_m))
+        tp[i, 1:at_least.shape[0] + 1] = popcount(at_least & y_bits, planes)
+        fp[i, 1:at_least.shape[0] + 1] = popcount(at_least & ~y_bits, planes)
+    return tp, fp
+
+
+def f1_bound(tp, fp, n_pos):
+    '''Calculates F1 score from a count of true positives and false 
+    positives, which makes it an upper bound when tp is an upper bound and
+    fp is a lower bound on the real counts.
+    '''
+    tp = np.array(tp, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(tp > 0, 2 * tp / (tp + n_pos + fp), 0.0)
+
+
+def meta_bounds(tp_a, fp_a, tp_b, fp_b, n_pos, n_neg):
+    '''Calculates upper bounds on F1 for the 'both' and 'any' metacombos
+    of two rules, using only each rule's own counts.
+    
+    Parameters
+      tp_a, fp_a: the true and false positive counts for the first rule
+      tp_b, fp_b: the true and false positive counts for the second rule(s)
+      n_pos: the number of positive records (int)
+      n_neg: the number of negative records (int)
+    
+    Returns
+      both, any: the bounds for the two modes (arrs of floats)
+    '''
+    # Both rules have to fire, so neither count can be beaten, and the
+    # false positives can only overlap so much
+    both_tp = np.minimum(tp_a, tp_b)
+    both_fp = np.maximum(0, fp_a + fp_b - n_neg)
+    
+    # Either rule can fire, so at best the true positives add up and the
+    # false positives overlap completely
+    any_tp = np.minimum(n_pos, tp_a + tp_b)
+    any_fp = np.maximum(fp_a, fp_b)
+    
+    return f1_bound(both_tp, both_fp, n_pos), f1_bound(any_tp, any_fp, n_pos)
+
+
+def pruned_meta_pairs(col_combos, counts, n_pos, n_neg, tops, min=(1, 1)):
+    '''Branch-and-bound version of meta_pairs() that skips pairs whose F1
+    bounds can't beat the current k-th best scores in either mode. Since
+    the pairs come out in the same order and top_k breaks ties by order, 
+    the final top-k lists are exactly the same as with meta_pairs().
+    
+    Parameters
+      col_combos: the column combos to pair up (list of lists of ints)
+      counts: the true and false positive counts for the first and second
+        combos, e.g., from side_count_table() (tuple)
+      n_pos: the number of positive records (int)
+      n_neg: the number of negative records (int)
+      tops: the top_k objects for the 'both' and 'any' modes (tuple)
+      min: a tuple of minimum counts for the two combos in each pair
+    
+    Yields
+      the pairs of combos that might still make it into the top-k
+    '''
+    n_combos = len(col_combos)
+    (tp_a, fp_a), (tp_b, fp_b) = counts
+    
+    # Representing the combos as bitmasks for quick overlap checks
+    masks = np.array([np.sum(2**np.array(cols, dtype=np.int64))
+                      for cols in col_combos])
+    sizes = np.array([len(cols) for cols in col_combos])
+    ok_b = sizes >= min[1]
+    
+    # Most true positives any later combo could add as the second side
+    max_tp_b = np.maximum.accumulate(np.where(ok_b, tp_b, 0)[::-1])[::-1]
+    
+    for i in range(n_combos - 1):
+        if sizes[i] < min[0]:
+            continue
+        thr_both = tops[0].threshold()
+        thr_any = tops[1].threshold()
+        
+        # Skipping the whole subtree of pairs starting with combo i if no
+        # second combo could get it into either top-k
+        both_ub = f1_bound(tp_a[i], 0, n_pos)
+        any_ub = f1_bound(np.minimum(n_pos, tp_a[i] + max_tp_b[i + 1]),
+                          fp_a[i], 
+                          n_pos)
+        if both_ub <= thr_both and any_ub <= thr_any:
+            continue
+        
+        # Otherwise bounding each valid pair in the subtree
+        j = np.arange(i + 1, n_combos)
+        j = j[ok_b[j] & (masks[j] & masks[i] == 0)]
+        both_b, any_b = meta_bounds(tp_a[i], fp_a[i], 
+                                    tp_b[j], fp_b[j],
+                                    n_pos, n_neg)
+        j = j[(both_b > thr_both) | (any_b > thr_any)]
+        for jj in j:
+            yield (col_combos[i], col_combos[jj])
+
+
+def chunk_iter(iterable, size):
+    '''Breaks an iterable into lists of (at most) size items each.'''
+    it = iter(iterable)
+    chunk = list(itertools.islice(it, size))
+    while len(chunk) > 0:
+        yield chunk
+        chunk = list(itertools.islice(it, size))
+
+
+class top_k:
+    '''Keeps the k highest-scoring items seen so far in a min-heap, so memory
+    stays fixed no matter how many items are scored. Ties go to the item that
+    was pushed first.
+    
+    Attributes:
+      k: the number of items to keep
+      heap: the heap of (score, -order, item) tuples
+      n_seen: the number of items pushed so far
+    '''
+    
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.n_seen = 0
+    
+    def push(self, score, item):
+        '''Adds an item to the heap if it beats the current k-th best.'''
+        entry = (score, -self.n_seen, item)
+        self.n_seen += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+    
+    def push_many(self, scores, items):
+        '''Runs push() on a batch of scores and their items.'''
+        for score, item in zip(scores, items):
+            self.push(score, item)
+    
+    def threshold(self):
+        '''Returns the score an item must beat to get in, or -inf.'''
+        if len(self.heap) < self.k:
+            return -np.inf
+        return self.heap[0][0]
+    
+    def best(self):
+        '''Returns the (score, item) tuples from best to worst.'''
+        ranked = sorted(self.heap, reverse=True)
+        return [(entry[0], entry[2]) for entry in ranked]
+
+
+# Number of set bits in each possible byte, for counting packed bitsets
+BIT_COUNTS = np.array([bin(i).count('1') for i in range(256)],
+                      dtype=np.uint8)
+
+
+def pack_cols(X):
+    '''Packs the columns of a binary matrix into bitsets, one per column.
+    
+    Parameters
+      X: a 2-d array (or 1-d array for a single column) with values in {0, 1}
+    
+    Returns
+      a uint8 array of shape (n_cols, ceil(n_rows / 8)) holding the bitsets
+    '''
+    X = np.array(X, dtype=bool)
+    if len(X.shape) == 1:
+        X = X.reshape(-1, 1)
+    return np.packbits(X.transpose(), axis=1)
+
+
+def popcount(bits, planes=None):
+    '''Counts the set bits in one or more packed bitsets.
+    
+    Parameters
+      bits: the packed bitsets (uint8 arr of shape (n_bytes,) or (k, n_bytes))
+      planes: weight_planes() for weighting each bit, or None to count each
+        one once
+    
+    Returns
+      the number (or total weight) of set bits (int, or arr of ints of 
+        shape (k,))
+    '''
+    if planes is None:
+        return np.sum(BIT_COUNTS[bits], axis=-1, dtype=np.int64)
+    
+    # Adding up the counts in each binary digit of the weights
+    total = 0
+    for b, plane in enumerate(planes):
+        total = total + popcount(bits & plane) * (1 << b)
+    return total
+
+
+def weight_planes(weights):
+    '''Splits integer row weights into packed bitsets, one per binary digit,
+    so popcount() can total the weights of the set bits.
+    
+    Parameters
+      weights: the weight for each row (arr of non-negative ints)
+    
+    Returns
+      a uint8 array of shape (n_digits, ceil(n_rows / 8)), where row b 
+        marks the rows whose weights have bit b set
+    '''
+    weights = np.array(weights, dtype=np.int64)
+    n_digits = np.maximum(int(np.max(weights)).bit_length(), 1)
+    digits = (weights >> np.arange(n_digits).reshape(-1, 1)) & 1
+    return np.packbits(digits.astype(bool), axis=1)
+
+
+def pattern_table(X, y):
+    '''Collapses a set of records to their distinct (symptom pattern, label)
+    combinations, so that rules only have to be evaluated once per pattern.
+    Every function here that takes weights (or weight_planes()) gives the 
+    same results on the table as on the records.
+    
+    Parameters
+      X: the binary features for each record (2-d arr)
+      y: the true labels (arr of {0, 1})
+    
+    Returns
+      patterns: the distinct rows of X, one per row of the table (2-d arr,
+        with each pattern showing up once for its negatives and once for 
+        its positives)
+      targets: the label for each row of the table (arr of {0, 1})
+      weights: the number of records in each row of the table, i.e., the 
+        negative and positive counts for each pattern (arr of ints)
+    '''
+    X = np.array(X, dtype=np.uint8)
+    y = np.array(y, dtype=np.uint8).reshape(-1, 1)
+    rows, weights = np.unique(np.concatenate([X, y], axis=1),
+                              axis=0,
+                              return_counts=True)
+    return rows[:, :-1], rows[:, -1], weights
+
+
+def packed_rowsums(bits, cols, min=1):
+    '''Packed version of rowsums(); determines which rows have at least min 
+    of the columns in cols set.
+    
+    Parameters
+      bits: the packed columns from pack_cols()
+      cols: the column numbers to sum over (list of ints)
+      min: the minimum number of set columns (int)
+    
+    Returns
+      a packed bitset marking the rows with at least min 1s
+    '''
+    sub = bits[cols]
+    
+    # Any-of-n and all-of-n only need a single reduction
+    if min <= 1:
+        return np.bitwise_or.reduce(sub, axis=0)
+    elif min == len(cols):
+        return np.bitwise_and.reduce(sub, axis=0)
+    elif min > len(cols):
+        return np.zeros(bits.shape[1], dtype=np.uint8)
+    
+    return packed_thresholds(bits, cols, max_m=min)[min - 1]
+
+
+def packed_thresholds(bits, cols, max_m=None):
+    '''Gets the packed m-of-n rules from a set of columns for every m at 
+    once, in a single pass over the columns.
+    
+    Parameters
+      bits: the packed columns from pack_cols()
+      cols: the column numbers to sum over (list of ints)
+      max_m: the largest m to keep track of (int, or None for len(cols))
+    
+    Returns
+      an array of shape (max_m, n_bytes), where row m - 1 marks the rows
+        with at least m of the columns set
+    '''
+    if max_m is None:
+        max_m = len(cols)
+    
+    # Keeping a running bitset for rows with at least k 1s, k = 1 to max_m,
+    # and adding the columns in one at a time
+    at_least = np.zeros((max_m, bits.shape[1]), dtype=np.uint8)
+    for i, col in enumerate(bits[cols]):
+        for k in range(np.minimum(i + 1, max_m) - 1, 0, -1):
+            at_least[k] |= at_least[k - 1] & col
+        at_least[0] |= col
+    
+    return at_least
+
+
+class rowsum_cache:
+    '''Memoizes packed_rowsums() vectors by column combo and minimum count,
+    evicting the least recently used ones when the cache goes over its 
+    memory budget. Since the same combos show up in many pairs (and under 
+    many m-pairs), this keeps pair evaluation down to one AND/OR of two
+    cached vectors most of the time.
+    
+    Attributes:
+      bits: the packed columns from pack_cols()
+      max_bytes: the memory budget for the cached vectors
+      nbytes: the memory currently used by the cached vectors
+      hits: the number of lookups served from the cache
+      misses: the number of lookups that had to be computed
+    '''
+    
+    def __init__(self, bits, max_bytes=2**26):
+        self.bits = bits
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.vectors = OrderedDict()
+        return
+    
+    def rowsums(self, cols, min=1):
+        '''Cached version of packed_rowsums() for the cache's columns.'''
+        min = np.maximum(min, 1)
+        key = (tuple(cols), min)
+        if key in self.vectors:
+            self.hits += 1
+            self.vectors.move_to_end(key)
+            return self.vectors[key]
+        
+        # Computing the vector, along with the ones for every other m when
+        # it takes a pass through all the levels anyway, since the other 
+        # m-of-n rules for the columns will likely be asked for too; any-of-n,
+        # all-of-n, and empty rules only need a single reduce
+        self.misses += 1
+        if min == 1 or min >= len(cols):
+            levels = {min: packed_rowsums(self.bits, list(cols), min=min)}
+        else:
+            at_least = packed_thresholds(self.bits, list(cols))
+            levels = {m + 1: vec for m, vec in enumerate(at_least)}
+        for m, vec in levels.items():
+            m_key = (tuple(cols), m)
+            if m_key not in self.vectors:
+                self.vectors[m_key] = vec
+                self.nbytes += vec.nbytes
+        self.vectors.move_to_end(key)
+        while self.nbytes > self.max_bytes and len(self.vectors) > 1:
+            old = self.vectors.popitem(last=False)[1]
+            self.nbytes -= old.nbytes
+        
+        return levels[min]
+    
+    def pairsum(self, c, min=(1, 1)):
+        '''Runs rowsums() on two sets of the cache's columns, like pairsum()
+        does for an unpacked array.'''
+        return (self.rowsums(c[0], min[0]), self.rowsums(c[1], min[1]))
+
+
+def packed_combo_sum(ctup):
+    '''Packed version of combo_sum(); determines whether both or any of a 
+    pair of packed bitsets are set.
+    
+    Parameters
+      ctup: a tuple of 2 packed bitsets, e.g., from rowsum_cache.pairsum()
+    
+    Returns
+      an array of shape (2, n_bytes) with the 'both' and 'any' bitsets
+    '''
+    return np.array([ctup[0] & ctup[1], ctup[0] | ctup[1]])
+
+
+def packed_any_levels(bits, c_max, c_min=1):
+    '''Generates packed any-of-n rules for every combination of c_min to
+    c_max columns, one combination size at a time. Each k-column rule is
+    built with a single OR of its (k-1)-column parent and one more column, so
+    only the previous level has to be kept around.
+    
+    Parameters
+      bits: the packed columns from pack_cols()
+      c_max: the maximum number of columns in a combination (int)
+      c_min: the minimum number of columns in a combination (int)
+    
+    Yields
+      k: the combination size (int)
+      combos: the column numbers for each rule, in the same (lexicographic)
+        order as itertools.combinations() (list of lists of ints)
+      rule_bits: the packed rules, one row per combination (2-d arr)
+    '''
+    n_cols = bits.shape[0]
+    combos = [[c] for c in range(n_cols)]
+    rule_bits = bits
+    
+    for k in range(1, c_max + 1):
+        if k >= c_min:
+            yield k, combos, rule_bits
+        
+        # Extending each rule with every column that comes after its last one
+        next_combos = []
+        next_bits = []
+        for i, combo in enumerate(combos):
+            last = combo[-1]
+            if last + 1 < n_cols:
+                next_combos += [combo + [c] for c in range(last + 1, n_cols)]
+                next_bits.append(rule_bits[i] | bits[last + 1:])
+        
+        # Stopping early if there are more levels than columns
+        if len(next_combos) == 0:
+            return
+        
+        combos = next_combos
+        rule_bits = np.concatenate(next_bits, axis=0)
+
+
+def pattern_codes(X):
+    '''Turns each row of a binary matrix into an integer, with column i as
+    bit i, e.g., for indexing a histogram of symptom patterns.
+    
+    Parameters
+      X: the binary features for each record (2-d arr with under 63 cols)
+    
+    Returns
+      an array of ints, one per row
+    '''
+    X = np.array(X, dtype=np.int64)
+    return X.dot(np.left_shift(1, np.arange(X.shape[1], dtype=np.int64)))
+
+
+def subset_sums(hist):
+    '''Zeta transform over the subsets of a set of columns; for every mask
+    S, adds up hist over the masks contained in S. Runs in O(2^p * p) for
+    p columns.
+    
+    Parameters
+      hist: values indexed by column mask (1-d arr of length 2^p)
+    
+    Returns
+      an array of the same shape with the subset sums
+    '''
+    out = np.array(hist, dtype=np.float64)
+    size = out.shape[0]
+    step = 1
+    while step < size:
+        # Adding each mask without this bit to the same mask with it
+        view = out.reshape(-1, 2, step)
+        view[:, 1, :] += view[:, 0, :]
+        step *= 2
+    return out
+
+
+def any_lattice(X, y, weights=None):
+    '''Gets the true and false positive counts for the any-of-n rule from
+    every subset of the columns at once. A record is negative for the rule
+    from S only when none of its columns in S are set, i.e., when its 
+    pattern is a subset of the columns not in S, so the counts all come 
+    from one subset_sums() of the pattern histograms.
+    
+    Parameters
+      X: the binary features for each record, or the patterns from
+        pattern_table() (2-d arr)
+      y: the true labels (arr of {0, 1})
+      weights: the number of records each row stands for, if any (arr)
+    
+    Returns
+      tp, fp: arrays of counts of length 2^n_cols, indexed by column mask
+        (e.g., mask 5 is any of columns 0 and 2)
+    '''
+    codes = pattern_codes(X)
+    y = np.array(y).ravel()
+    if weights is None:
+        weights = np.ones(codes.shape[0])
+    weights = np.array(weights, dtype=np.float64)
+    size = 2**np.array(X).shape[1]
+    
+    # Counting the positive and negative records with each pattern
+    pos = np.bincount(codes, weights=weights * (y == 1), minlength=size)
+    neg = np.bincount(codes, weights=weights * (y == 0), minlength=size)
+    
+    # Flipping the masks so each rule looks up the patterns that miss it
+    full = size - 1
+    rule_masks = np.arange(size)
+    tp = np.sum(pos) - subset_sums(pos)[full ^ rule_masks]
+    fp = np.sum(neg) - subset_sums(neg)[full ^ rule_masks]
+    return tp.round().astype(np.int64), fp.round().astype(np.int64)
+
+
+def lattice_metrics(X, y, weights=None, round=4):
+    '''Runs count_metrics() on the any-of-n rules from every non-empty 
+    subset of the columns, using any_lattice().
+    
+    Parameters
+      X: the binary features for each record, or the patterns from
+        pattern_table() (2-d arr)
+      y: the true labels (arr of {0, 1})
+      weights: the number of records each row stands for, if any (arr)
+      round: number of significant digits to report
+    
+    Returns
+      a data frame with one row per rule, indexed by column mask, with the
+        columns of clf_metrics() plus combo_size
+    '''
+    tp, fp = any_lattice(X, y, weights)
+    masks = np.arange(1, tp.shape[0])
+    y = np.array(y).ravel()
+    if weights is None:
+        weights = np.ones(y.shape[0], dtype=np.int64)
+    n_pos = np.sum(weights * (y == 1))
+    n_neg = np.sum(weights * (y == 0))
+    out = count_metrics(tp=tp[masks],
+                        fp=fp[masks],
+                        tn=n_neg - fp[masks],
+                        fn=n_pos - tp[masks],
+                        round=round)
+    out.index = masks
+    out['combo_size'] = [bin(m).count('1') for m in masks]
+    return out
+
+
+def packed_confusion(targets, guesses, n, planes=None):
+    '''Calculates the 2x2 table counts for packed labels.
+    
+    Parameters
+      targets: the packed true labels (1-d packed bitset)
+      guesses: the packed predicted labels (packed bitset or stack of them)
+      n: the number of records the labels were packed from, or their total
+        weight if they're weighted (int)
+      planes: weight_planes() for the rows, if they're weighted
+    
+    Returns
+      tp, fp, tn, fn: the cell counts (ints, or arrs of ints for a stack)
+    '''
+    tp = popcount(guesses & targets, planes)
+    fp = popcount(guesses & ~targets, planes)
+    n_pos = popcount(targets, planes)
+    fn = n_pos - tp
+    tn = n - n_pos - fp
+    return tp, fp, tn, fn
+
+
+def packed_f1(targets, guesses, planes=None):
+    '''Calculates F1 score for packed labels; 0 when there are no true
+    positives, like sklearn.metrics.f1_score().
+    
+    Parameters
+      targets: the packed true labels (1-d packed bitset)
+      guesses: the packed predicted labels (packed bitset or stack of them)
+      planes: weight_planes() for the rows, if they're weighted
+    
+    Returns
+      the F1 score (float, or arr of floats for a stack)
+    '''
+    tp2 = 2 * popcount(guesses & targets, planes)
+    errors = popcount(guesses ^ targets, planes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1 = np.where(tp2 > 0, tp2 / (tp2 + errors), 0.0)
+    if f1.shape == ():
+        return float(f1)
+    return f1
+
+
+def fingerprint(*args):
+    '''Makes a short hash of a set of settings and arrays, e.g., for making
+    sure checkpoints came from the same configuration and data.'''
+    h = hashlib.sha1()
+    for arg in args:
+        if type(arg) == np.ndarray:
+            h.update(str(arg.shape).encode())
+            h.update(np.ascontiguousarray(arg).tobytes())
+        else:
+            h.update(repr(arg).encode())
+    return h.hexdigest()
+
+
+class checkpoint:
+    '''Saves the results from each shard of a long loop as soon as it 
+    finishes, so a restarted run can skip the shards that are already done.
+    Files are written to a temporary name and then moved into place, so a 
+    run that gets killed mid-write never leaves a partial shard behind.
+    
+    Attributes:
+      dir: the directory holding the shard files and manifest
+      key: the fingerprint() of the settings that produced the shards
+      done: the numbers of the finished shards
+    '''
+    
+    def __init__(self, dir, key):
+        '''Opens a checkpoint directory, starting over if the manifest
+        is missing or was written under a different key.
+        
+        Parameters
+          dir: the directory for the shard files and manifest (str)
+          key: the fingerprint of the current settings (str)
+        '''
+        self.dir = dir
+        self.key = key
+        self.done = []
+        os.makedirs(dir, exist_ok=True)
+        
+        # Picking up the finished shards if the settings match
+        manifest = os.path.join(dir, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest, 'r') as f:
+                info = json.load(f)
+            if info['key'] == key:
+                self.done = sorted(info['done'])
+        
+        self._write_manifest()
+        return
+    
+    def _shard_path(self, shard):
+        return os.path.join(self.dir, 'shard_' + str(shard) + '.csv')
+    
+    def _write_manifest(self):
+        manifest = os.path.join(self.dir, 'manifest.json')
+        with open(manifest + '.tmp', 'w') as f:
+            json.dump({'key': self.key, 'done': self.done}, f)
+        os.replace(manifest + '.tmp', manifest)
+    
+    def save(self, shard, df=None):
+        '''Writes a shard's results (if any) and marks it as done.
+        
+        Parameters
+          shard: the shard number (int)
+          df: the shard's results (pd.DataFrame, or None for no results)
+        '''
+        path = self._shard_path(shard)
+        if df is not None:
+            df.to_csv(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        elif os.path.exists(path):
+            os.remove(path)
+        if shard not in self.done:
+            self.done = sorted(self.done + [shard])
+        self._write_manifest()
+    
+    def load(self, shard):
+        '''Reads a finished shard's results, or None if it had none.'''
+        path = self._shard_path(shard)
+        if not os.path.exists(path):
+            return None
+        return pd.read_csv(path, float_precision='round_trip')
+    
+    def load_all(self):
+        '''Returns a dict of the results for all finished shards.'''
+        return {shard: self.load(shard) for shard in self.done}